@@ -1,4 +1,22 @@
+import asyncio
+from collections import OrderedDict
 from functools import update_wrapper
+import hashlib
+import inspect
+import json
+import pickle
+import sqlite3
+import threading
+import time
+
+
+KWARGS_MARK = object()
+"""Separator of positional and keyword arguments in cache keys"""
+PROFILE_BUCKETS = 64
+"""
+Number of latency histogram buckets (bucket `i` counts calls lasting less than 2^i ns, the
+last one is reached in 292 years)
+"""
 
 
 def disable(func):
@@ -25,28 +43,372 @@ def decorator(func):
 def countcalls(func):
     """
     Decorator that counts calls made to the function decorated.
+    Calls are counted under a lock, so counter is exact when function is called from
+    several threads. Coroutine function is decorated with coroutine function.
     """
-    def wrapper(*args, **kwargs):
-        wrapper.calls += 1
-        return func(*args, **kwargs)
+    lock = threading.Lock()
+
+    if inspect.iscoroutinefunction(func):
+        async def wrapper(*args, **kwargs):
+            with lock:
+                wrapper.calls += 1
+            return await func(*args, **kwargs)
+    else:
+        def wrapper(*args, **kwargs):
+            with lock:
+                wrapper.calls += 1
+            return func(*args, **kwargs)
     wrapper.calls = 0
     return wrapper
 
 
+def make_key(args, kwargs):
+    """
+    Make cache key of function arguments. Arguments are used as is if they are hashable,
+    otherwise their repr is used. Types of arguments are part of the key, so equal
+    arguments of different types (e.g. 1, 1.0 and True) are cached separately.
+    """
+    key = args + tuple(map(type, args))
+    if kwargs:
+        items = tuple(sorted(kwargs.items()))
+        key += (KWARGS_MARK,) + items + tuple(type(value) for _, value in items)
+    try:
+        hash(key)
+    except TypeError:
+        return KWARGS_MARK, repr(key)
+    return key
+
+
+class SingleFlight:
+    """
+    Group of concurrent calls: while a call with some key is running in one thread, calls
+    with the same key from other threads wait for its result instead of computing it again.
+    Caller which started a flight computes the value itself and then finishes the flight,
+    so single flight adds no stack frames to the call.
+    """
+    class Flight:
+        __slots__ = ('thread', 'done', 'result', 'error')
+
+        def __init__(self):
+            self.thread = threading.get_ident()
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+        def wait(self):
+            """Wait for the result of the call (exception of the call is re-raised)."""
+            self.done.wait()
+            if self.error is not None:
+                raise self.error
+            return self.result
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def begin(self, key):
+        """
+        Join the call with the key: returns `(flight, True)` if there was no such call, and
+        caller should compute the value and `finish` the flight, otherwise returns running
+        flight and False.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self.flights[key] = self.Flight()
+            return flight, True
+
+    def finish(self, key, flight, result=None, error=None):
+        """Finish the call started by `begin` and wake up waiting threads."""
+        flight.result = result
+        flight.error = error
+        with self.lock:
+            del self.flights[key]
+        flight.done.set()
+
+
+def make_canonical(value):
+    """
+    Make form of value which is pickled the same way in every process: containers are
+    replaced by pairs of type and items, items of sets and dicts (except `OrderedDict`)
+    are sorted by pickled form, since their order depends on hash randomization or
+    insertion order.
+    """
+    if isinstance(value, (set, frozenset)):
+        items = [make_canonical(item) for item in value]
+        return type(value), sorted(items, key=lambda item: pickle.dumps(item, protocol=4))
+    if isinstance(value, dict):
+        items = [(make_canonical(key), make_canonical(item)) for key, item in value.items()]
+        if not isinstance(value, OrderedDict):
+            items.sort(key=lambda item: pickle.dumps(item, protocol=4))
+        return type(value), items
+    if isinstance(value, (list, tuple)):
+        return type(value), [make_canonical(item) for item in value]
+    return value
+
+
+def make_persistent_key(args, kwargs):
+    """
+    Make cache key of function arguments which is the same in every process: digest of
+    pickled canonical form of arguments (or of their repr if they can not be pickled).
+    """
+    try:
+        data = pickle.dumps(make_canonical((args, kwargs)), protocol=4)
+    except (pickle.PicklingError, TypeError, AttributeError, RecursionError):
+        data = repr((args, sorted(kwargs.items()))).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_code_version(func):
+    """
+    Get version of function code: digest of its source (or of its bytecode and constants
+    if source is not available).
+    """
+    try:
+        data = inspect.getsource(func).encode()
+    except (OSError, TypeError):
+        code = func.__code__
+        data = code.co_code + repr(code.co_consts).encode()
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def memoize(func, lookup, store, refresh=False, key_func=make_key, recheck=None):
+    """
+    Make memoizing wrapper of a function from cache access functions:
+    `lookup(key)` returns `(True, value)` or `(False, None)` and `store(key, value)` saves
+    computed value. Concurrent misses with the same key compute value once (in threads, or
+    in every event loop if function is coroutine function, awaited result is cached then),
+    recursive call with the same key from the computing thread is computed directly.
+    If `refresh` is set, attributes of the function are copied to wrapper on every call.
+    `key_func(args, kwargs)` makes cache key of call arguments. Thread which starts computing
+    looks value up again with `recheck(key)` (`lookup` by default), since concurrent call
+    could store it just before.
+    """
+    if recheck is None:
+        recheck = lookup
+    if inspect.iscoroutinefunction(func):
+        # Running tasks by event loop and key (every thread may run its own loop)
+        tasks = {}
+        tasks_lock = threading.Lock()
+
+        def forget(task_key):
+            with tasks_lock:
+                tasks.pop(task_key, None)
+
+        async def load_async(key, args, kwargs):
+            value = await func(*args, **kwargs)
+            store(key, value)
+            return value
+
+        async def wrapper(*args, **kwargs):
+            if refresh:
+                update_wrapper(wrapper, func)
+            key = key_func(args, kwargs)
+            found, value = lookup(key)
+            if found:
+                return value
+            task_key = asyncio.get_running_loop(), key
+            with tasks_lock:
+                task = tasks.get(task_key)
+                if task is None:
+                    task = tasks[task_key] = asyncio.ensure_future(load_async(key, args, kwargs))
+                    task.add_done_callback(lambda _: forget(task_key))
+            return await asyncio.shield(task)
+        return wrapper
+
+    flights = SingleFlight()
+
+    def wrapper(*args, **kwargs):
+        if refresh:
+            update_wrapper(wrapper, func)
+        key = key_func(args, kwargs)
+        found, value = lookup(key)
+        if found:
+            return value
+
+        # Value is computed right here (not in nested helper), so that memoized recursive
+        # function takes as few stack frames as without memoization
+        flight, owner = flights.begin(key)
+        if not owner:
+            if flight.thread != threading.get_ident():
+                return flight.wait()
+            return func(*args, **kwargs)
+        try:
+            found, value = recheck(key)
+            if not found:
+                value = func(*args, **kwargs)
+                store(key, value)
+        except BaseException as e:
+            flights.finish(key, flight, error=e)
+            raise
+        flights.finish(key, flight, value)
+        return value
+    return wrapper
+
+
 @decorator
 def memo(func):
     """
     Memoize a function so that it caches all return values for faster future lookups.
+    Safe to use from several threads and with coroutine functions (see `memoize`).
     """
     cache = {}
 
-    def wrapper(*args, **kwargs):
-        update_wrapper(wrapper, func)
-        key = str(args) + str(kwargs)
-        if key not in cache:
-            cache[key] = func(*args, **kwargs)
-        return cache[key]
-    return wrapper
+    def lookup(key):
+        try:
+            return True, cache[key]
+        except KeyError:
+            return False, None
+
+    def store(key, value):
+        cache[key] = value
+
+    return memoize(func, lookup, store, refresh=True)
+
+
+def lru_memo(maxsize=128, ttl=None, timer=time.monotonic):
+    """
+    Memoize a function keeping at most `maxsize` return values (least recently used are
+    evicted first, None means no limit) for at most `ttl` seconds (None means forever).
+    Safe to use from several threads and with coroutine functions (see `memoize`).
+
+    Cache statistics are available as `hits`, `misses` (failed lookups, calls waiting for
+    concurrent call with the same key included) and `evictions` (expired values included)
+    attributes of decorated function, `cache_clear()` empties the cache.
+    """
+    @decorator
+    def dec(func):
+        cache = OrderedDict()
+        lock = threading.Lock()
+
+        def find(key, count=False):
+            with lock:
+                entry = cache.get(key)
+                if entry is not None:
+                    value, expires = entry
+                    if expires is None or timer() < expires:
+                        cache.move_to_end(key)
+                        if count:
+                            wrapper.hits += 1
+                        return True, value
+                    del cache[key]
+                    wrapper.evictions += 1
+                if count:
+                    wrapper.misses += 1
+                return False, None
+
+        def lookup(key):
+            return find(key, count=True)
+
+        def store(key, value):
+            with lock:
+                cache[key] = value, None if ttl is None else timer() + ttl
+                cache.move_to_end(key)
+                if maxsize is not None and len(cache) > maxsize:
+                    cache.popitem(last=False)
+                    wrapper.evictions += 1
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+                wrapper.hits = wrapper.misses = wrapper.evictions = 0
+
+        wrapper = memoize(func, lookup, store, recheck=find)
+        wrapper.hits = wrapper.misses = wrapper.evictions = 0
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return dec
+
+
+class MappingBackend:
+    """
+    Memo backend keeping entries in a mapping with string keys, e.g. `dict`, `shelve` shelf
+    (persistent) or `multiprocessing.Manager().dict()` (shared by worker processes).
+    Entries of other versions of registered function are removed from the mapping.
+    """
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.lock = threading.Lock()
+
+    def register(self, name, version):
+        prefix = name + ':'
+        current = '{}{}:'.format(prefix, version)
+        with self.lock:
+            stale = [key for key in self.mapping.keys()
+                     if key.startswith(prefix) and not key.startswith(current)]
+            for key in stale:
+                del self.mapping[key]
+
+    def get(self, name, version, key):
+        with self.lock:
+            try:
+                return True, self.mapping['{}:{}:{}'.format(name, version, key)]
+            except KeyError:
+                return False, None
+
+    def set(self, name, version, key, value):
+        with self.lock:
+            self.mapping['{}:{}:{}'.format(name, version, key)] = value
+
+
+class SQLiteBackend:
+    """
+    Persistent memo backend keeping pickled entries in SQLite database, which can be shared
+    by several processes. Entries of other versions of registered function are removed.
+    """
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS memo (name TEXT, key TEXT, '
+                                'version TEXT, value BLOB, PRIMARY KEY (name, key))')
+
+    def register(self, name, version):
+        with self.lock:
+            self.connection.execute('DELETE FROM memo WHERE name = ? AND version != ?',
+                                    (name, version))
+
+    def get(self, name, version, key):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT value FROM memo WHERE name = ? AND key = ? AND version = ?',
+                (name, key, version)
+            ).fetchone()
+        if row is None:
+            return False, None
+        return True, pickle.loads(row[0])
+
+    def set(self, name, version, key, value):
+        data = pickle.dumps(value, protocol=4)
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?)',
+                                    (name, key, version, data))
+
+    def close(self):
+        self.connection.close()
+
+
+def persistent_memo(backend, version=None):
+    """
+    Memoize a function in backend (see `MappingBackend` and `SQLiteBackend`), so that
+    return values survive restarts or are shared by processes. Entries are bound to
+    function version (digest of its source by default), so changing the function
+    invalidates them. Arguments and return values should be picklable.
+    """
+    @decorator
+    def dec(func):
+        name = '{}.{}'.format(func.__module__, func.__qualname__)
+        func_version = version or get_code_version(func)
+        backend.register(name, func_version)
+
+        def lookup(key):
+            return backend.get(name, func_version, key)
+
+        def store(key, value):
+            backend.set(name, func_version, key, value)
+
+        return memoize(func, lookup, store, key_func=make_persistent_key)
+    return dec
 
 
 @decorator
@@ -56,10 +418,190 @@ def n_ary(func):
     that f(x, y, z) = f(x, f(y, z)), etc. Also allow f(x) = x.
     """
     def wrapper(x, *args):
-        return x if not args else func(x, wrapper(*args))
+        if not args:
+            return x
+        result = args[-1]
+        for arg in reversed(args[:-1]):
+            result = func(arg, result)
+        return func(x, result)
+    return wrapper
+
+
+@decorator
+def n_ary_left(func):
+    """
+    Given binary function f(x, y), return an n_ary function such
+    that f(x, y, z) = f(f(x, y), z), etc. Also allow f(x) = x.
+    """
+    def wrapper(x, *args):
+        for arg in args:
+            x = func(x, arg)
+        return x
+    return wrapper
+
+
+@decorator
+def n_ary_tree(func):
+    """
+    Given associative binary function f(x, y), return an n_ary function such
+    that f(x, y, z, w) = f(f(x, y), f(z, w)), etc. Also allow f(x) = x.
+    Calls of every level are independent, so they can be parallelized.
+    """
+    def wrapper(x, *args):
+        values = (x,) + args
+        while len(values) > 1:
+            pairs = [func(values[i], values[i + 1]) for i in range(0, len(values) - 1, 2)]
+            if len(values) % 2:
+                pairs.append(values[-1])
+            values = pairs
+        return values[0]
     return wrapper
 
 
+class CallStats:
+    """
+    Calls count, cumulative/min/max latency and latency histogram of profiled function.
+    Statistics are updated without a lock to keep overhead low, so a few calls may be lost
+    when function is called from several threads at the same time.
+    """
+    __slots__ = ('total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.total = 0
+        self.min = 2 ** PROFILE_BUCKETS
+        self.max = 0
+        self.buckets = [0] * PROFILE_BUCKETS
+
+    @property
+    def calls(self):
+        return sum(self.buckets)
+
+    def add(self, elapsed):
+        self.buckets[elapsed.bit_length()] += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        if elapsed < self.min:
+            self.min = elapsed
+
+    def percentile(self, percent):
+        """
+        Get approximate latency percentile (upper bound of histogram bucket, so it is at most
+        twice the real value).
+        """
+        rank = percent / 100 * self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(2 ** i, self.max)
+        return self.max
+
+    def as_dict(self):
+        """Get statistics in nanoseconds as dict."""
+        calls = self.calls
+        return {
+            'calls': calls,
+            'total_ns': self.total,
+            'mean_ns': self.total // calls if calls else 0,
+            'min_ns': self.min if calls else 0,
+            'p50_ns': self.percentile(50),
+            'p99_ns': self.percentile(99),
+            'max_ns': self.max,
+            'histogram': {2 ** i: count for i, count in enumerate(self.buckets) if count},
+        }
+
+
+class Profiler:
+    """
+    Registry of profiled functions statistics. When profiler is disabled, profiled
+    functions only check a flag before calling the original function.
+    """
+    def __init__(self):
+        self.enabled = True
+        self.stats = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def register(self, name):
+        return self.stats.setdefault(name, CallStats())
+
+    def reset(self):
+        for stats in self.stats.values():
+            stats.reset()
+
+    def summary(self):
+        """Get statistics table sorted by cumulative time (times in microseconds)."""
+        row = '{:<30} {:>8} {:>12} {:>10} {:>10} {:>10} {:>10} {:>10}'
+        lines = [row.format('function', 'calls', 'total', 'mean', 'min', 'p50', 'p99', 'max')]
+        for name, stats in sorted(self.stats.items(), key=lambda item: -item[1].total):
+            data = stats.as_dict()
+            lines.append(row.format(name, data['calls'], *(
+                '{:.1f}'.format(data[key] / 1000)
+                for key in ('total_ns', 'mean_ns', 'min_ns', 'p50_ns', 'p99_ns', 'max_ns')
+            )))
+        return '\n'.join(lines)
+
+    def to_json(self):
+        return json.dumps({name: stats.as_dict() for name, stats in self.stats.items()})
+
+
+PROFILER = Profiler()
+"""Default profiler"""
+
+
+def profile(name=None, profiler=PROFILER):
+    """
+    Record calls count and latency of function decorated (with `time.perf_counter_ns`)
+    in profiler under `name` (module and qualified function name by default). Statistics are
+    available as `stats` attribute of decorated function. Time of coroutine function
+    includes awaiting, time of recursive function includes nested calls.
+
+    @profile()
+    def handle(request):
+        ....
+
+    >>> PROFILER.summary()
+    >>> PROFILER.disable()
+    """
+    @decorator
+    def dec(func):
+        stats = profiler.register(name or '{}.{}'.format(func.__module__, func.__qualname__))
+
+        if inspect.iscoroutinefunction(func):
+            async def wrapper(*args, **kwargs):
+                if not profiler.enabled:
+                    return await func(*args, **kwargs)
+                start = time.perf_counter_ns()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    stats.add(time.perf_counter_ns() - start)
+        else:
+            def wrapper(*args, **kwargs):
+                if not profiler.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter_ns()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    stats.add(time.perf_counter_ns() - start)
+        wrapper.stats = stats
+        return wrapper
+    return dec
+
+
+timed = profile()
+"""Profile function decorated with default name and profiler"""
+
+
 def trace(filler):
     """Trace calls made to function decorated.
 
@@ -120,6 +662,38 @@ def fib(n):
     return 1 if n <= 1 else fib(n-1) + fib(n-2)
 
 
+@lru_memo(maxsize=2)
+def square(n):
+    return n * n
+
+
+@countcalls
+@persistent_memo(MappingBackend({}))
+def cube(n):
+    return n ** 3
+
+
+@n_ary_tree
+def concat(a, b):
+    return a + b
+
+
+@countcalls
+@memo
+async def delay(n):
+    await asyncio.sleep(0.1)
+    return n
+
+
+@timed
+def power(n):
+    return 2 ** n
+
+
+async def gather_delays():
+    return await asyncio.gather(*(delay(n) for n in (1, 2, 1, 2, 1)))
+
+
 def main():
     print('===== foo =====')
     print(foo(4, 3))
@@ -138,6 +712,34 @@ def main():
     print(fib.__name__, 'was called', fib.calls, 'times')
     print(fib.__doc__)
 
+    print('===== square =====')
+    for n in (2, 3, 2, 4, 3):
+        print(square(n))
+    print(square.__name__, 'cache: hits', square.hits, 'misses', square.misses,
+          'evictions', square.evictions)
+
+    print('===== delay =====')
+    start = time.monotonic()
+    print(asyncio.run(gather_delays()))
+    print(delay.__name__, 'was called', delay.calls, 'times and took',
+          round(time.monotonic() - start, 1), 'seconds')
+
+    print('===== cube =====')
+    print(cube(3), cube(3), cube(4))
+    print(cube.__name__, 'was called', cube.calls, 'times')
+
+    print('===== concat =====')
+    print(concat('a', 'b', 'c', 'd', 'e'))
+    print(len(concat(*['x'] * 100000)))
+
+    print('===== power =====')
+    for n in range(1000):
+        power(n)
+    PROFILER.disable()
+    power(1000)
+    print(power.__name__, 'was profiled', power.stats.calls, 'times')
+    print(PROFILER.summary())
+
 
 if __name__ == '__main__':
     main()
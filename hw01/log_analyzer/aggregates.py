@@ -0,0 +1,364 @@
+from array import array
+from functools import partial
+import math
+from statistics import median
+
+
+DEFAULT_SKETCH_ACCURACY = 0.01
+"""Default relative accuracy of quantile sketch"""
+SKETCH_MAX_BINS = 2048
+"""Maximum number of sketch bins (lowest bins are collapsed when it is exceeded)"""
+SKETCH_MIN_VALUE = 1e-9
+"""Values below this threshold are counted as zeros"""
+
+
+class ExactStats:
+    """
+    Request times of single URL stored in compact `array('d')` with running count/max
+
+    Sum is computed from times in file order (not kept running), so it does not depend on
+    how the log was split between parsing processes
+    """
+    __slots__ = ('count', 'max', 'times')
+
+    def __init__(self):
+        self.count = 0
+        self.max = 0.0
+        self.times = array('d')
+
+    def append(self, value):
+        """
+        Add request time
+
+        Args:
+            value (float): Request time
+        """
+        self.count += 1
+        if value > self.max:
+            self.max = value
+        self.times.append(value)
+
+    def extend(self, other):
+        """
+        Merge statistics of other part of the log
+
+        Args:
+            other (ExactStats): Statistics to merge
+        """
+        self.count += other.count
+        self.max = max(self.max, other.max)
+        self.times.extend(other.times)
+
+    @property
+    def total(self):
+        """Sum of request times"""
+        return sum(self.times)
+
+    def quantile(self, q):
+        """
+        Get exact quantile (linear interpolation between closest ranks)
+
+        Args:
+            q (float): Quantile in range [0, 1]
+
+        Returns:
+            float: Quantile value
+        """
+        return get_quantile(sorted(self.times), q)
+
+    def quantiles(self, qs):
+        """
+        Get several exact quantiles sorting request times once
+
+        Args:
+            qs (list): Quantiles in range [0, 1]
+
+        Returns:
+            list: Quantile values
+        """
+        values = sorted(self.times)
+        return [get_quantile(values, q) for q in qs]
+
+    def median(self):
+        """
+        Get exact median
+
+        Returns:
+            float: Median value
+        """
+        return self.quantile(0.5)
+
+    def __eq__(self, other):
+        return isinstance(other, ExactStats) and self.times == other.times
+
+    def __repr__(self):
+        return 'ExactStats({})'.format(list(self.times))
+
+
+class SketchStats:
+    """
+    Request times of single URL stored as running count/sum/max and logarithmic histogram
+
+    Sum is kept as exact non-overlapping partial sums (see `add_partial`), so it is correctly
+    rounded and does not depend on order of values and on how the log was split between
+    parsing processes.
+
+    Histogram bin `i` holds values in range (gamma^(i-1), gamma^i], where
+    gamma = (1 + accuracy) / (1 - accuracy). Every returned quantile is within `accuracy`
+    relative error of the sample value having quantile rank (for median of even-sized sample
+    it is the lower of two middle values), e.g. with default accuracy 0.01 median 0.5s is
+    reported as value in range [0.495, 0.505]. Number of bins depends only on values range:
+    times from 1ms to 100s take ~580 bins, and it never exceeds `max_bins` (lowest bins
+    are collapsed, so only quantiles of the smallest values lose accuracy). Sketches with
+    the same accuracy can be merged without loss of accuracy.
+    """
+    __slots__ = ('count', 'partials', 'max', 'zeros', 'bins', 'gamma', 'log_gamma', 'max_bins')
+
+    def __init__(self, accuracy=DEFAULT_SKETCH_ACCURACY, max_bins=SKETCH_MAX_BINS):
+        if not 0 < accuracy < 1:
+            raise ValueError('Sketch accuracy should be in range (0, 1)')
+        self.count = 0
+        self.partials = []
+        self.max = 0.0
+        self.zeros = 0
+        self.bins = {}
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+
+    def append(self, value):
+        """
+        Add request time
+
+        Args:
+            value (float): Request time
+        """
+        self.count += 1
+        add_partial(self.partials, value)
+        if value > self.max:
+            self.max = value
+
+        if value < SKETCH_MIN_VALUE:
+            self.zeros += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        bins = self.bins
+        bins[index] = bins.get(index, 0) + 1
+        if len(bins) > self.max_bins:
+            self._collapse()
+
+    def extend(self, other):
+        """
+        Merge statistics of other part of the log
+
+        Args:
+            other (SketchStats): Statistics to merge
+
+        Raises:
+            ValueError: If sketches have different accuracy
+        """
+        if other.gamma != self.gamma:
+            raise ValueError('Sketches with different accuracy can not be merged')
+        self.count += other.count
+        for partial in other.partials:
+            add_partial(self.partials, partial)
+        self.max = max(self.max, other.max)
+        self.zeros += other.zeros
+        bins = self.bins
+        for index, count in other.bins.items():
+            bins[index] = bins.get(index, 0) + count
+        if len(bins) > self.max_bins:
+            self._collapse()
+
+    @property
+    def total(self):
+        """Sum of request times"""
+        return math.fsum(self.partials)
+
+    def _collapse(self):
+        """Collapse lowest bins into one so that bins count does not exceed `max_bins`"""
+        indexes = sorted(self.bins)
+        excess = indexes[:len(indexes) - self.max_bins]
+        self.bins[indexes[len(excess)]] += sum(self.bins.pop(index) for index in excess)
+
+    def quantile(self, q):
+        """
+        Get approximate quantile
+
+        Args:
+            q (float): Quantile in range [0, 1]
+
+        Returns:
+            float: Quantile value
+        """
+        return self.quantiles([q])[0]
+
+    def quantiles(self, qs):
+        """
+        Get several approximate quantiles in single pass over histogram
+
+        Args:
+            qs (list): Quantiles in range [0, 1]
+
+        Returns:
+            list: Quantile values
+        """
+        if not self.count:
+            raise ValueError('Quantile of empty sketch')
+        ranks = sorted((int(q * (self.count - 1)), i) for i, q in enumerate(qs))
+        values = [self.max] * len(qs)
+        pending = iter(ranks)
+        rank, i = next(pending, (None, None))
+        while rank is not None and rank < self.zeros:
+            values[i] = 0.0
+            rank, i = next(pending, (None, None))
+
+        seen = self.zeros
+        for index in sorted(self.bins):
+            if rank is None:
+                break
+            seen += self.bins[index]
+            value = min(2 * self.gamma ** index / (self.gamma + 1), self.max)
+            while rank is not None and seen > rank:
+                if rank < self.count - 1:
+                    values[i] = value
+                rank, i = next(pending, (None, None))
+        return values
+
+    def median(self):
+        """
+        Get approximate median
+
+        Returns:
+            float: Median value
+        """
+        return self.quantile(0.5)
+
+    def __repr__(self):
+        return 'SketchStats(count={}, total={}, max={})'.format(self.count, self.total, self.max)
+
+
+def add_partial(partials, value):
+    """
+    Add value to exact sum represented by non-overlapping partial sums in increasing
+    magnitude order (Shewchuk's algorithm, `math.fsum` of partials is correctly rounded sum)
+
+    Args:
+        partials (list): Partial sums (changed in place)
+        value (float): Value to add
+    """
+    i = 0
+    for partial in partials:
+        if abs(value) < abs(partial):
+            value, partial = partial, value
+        high = value + partial
+        low = partial - (high - value)
+        if low:
+            partials[i] = low
+            i += 1
+        value = high
+    partials[i:] = [value]
+
+
+def get_quantile(values, q):
+    """
+    Get quantile of sorted values (linear interpolation between closest ranks)
+
+    Args:
+        values (list): Sorted values
+        q (float): Quantile in range [0, 1]
+
+    Returns:
+        float: Quantile value
+    """
+    position = q * (len(values) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def get_summary(request_times):
+    """
+    Get count, sum and max of URL request times
+
+    Args:
+        request_times (list|ExactStats|SketchStats): Request times
+
+    Returns:
+        tuple: Requests count, time sum and max time
+    """
+    if isinstance(request_times, list):
+        return len(request_times), sum(request_times), max(request_times)
+    return request_times.count, request_times.total, request_times.max
+
+
+def get_count(request_times):
+    """
+    Get count of URL requests
+
+    Args:
+        request_times (list|ExactStats|SketchStats): Request times
+
+    Returns:
+        int: Requests count
+    """
+    if isinstance(request_times, list):
+        return len(request_times)
+    return request_times.count
+
+
+def get_median(request_times):
+    """
+    Get median of URL request times
+
+    Args:
+        request_times (list|ExactStats|SketchStats): Request times
+
+    Returns:
+        float: Median value
+    """
+    if isinstance(request_times, list):
+        return median(request_times)
+    return request_times.median()
+
+
+def get_percentiles(request_times, percentiles):
+    """
+    Get percentiles of URL request times (exact for list and `ExactStats`, approximate for
+    `SketchStats`)
+
+    Args:
+        request_times (list|ExactStats|SketchStats): Request times
+        percentiles (list): Percentiles in range [0, 100]
+
+    Returns:
+        list: Percentile values
+    """
+    qs = [percentile / 100.0 for percentile in percentiles]
+    if isinstance(request_times, list):
+        values = sorted(request_times)
+        return [get_quantile(values, q) for q in qs]
+    return request_times.quantiles(qs)
+
+
+def get_stats_factory(aggregate, accuracy=DEFAULT_SKETCH_ACCURACY):
+    """
+    Get factory of per-URL request times container
+
+    Args:
+        aggregate (str): Aggregate mode (`list`, `exact` or `sketch`)
+        accuracy (float): Relative accuracy of quantile sketch
+
+    Returns:
+        callable: Container factory
+
+    Raises:
+        ValueError: If aggregate mode is unknown
+    """
+    if aggregate == 'list':
+        return list
+    elif aggregate == 'exact':
+        return ExactStats
+    elif aggregate == 'sketch':
+        return partial(SketchStats, accuracy)
+    raise ValueError('Unknown aggregate mode "{}"'.format(aggregate))
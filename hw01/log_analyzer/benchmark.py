@@ -0,0 +1,304 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+import gzip
+import json
+import pathlib
+import random
+import resource
+import tempfile
+import time
+import timeit
+
+import log_analyzer as la
+
+
+USER_AGENTS = (
+    'Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5',
+    'Python-urllib/2.7',
+    'Slotovod',
+    'Microsoft Office Excel 2013',
+    '-',
+)
+"""User agents of synthetic log lines"""
+URL_TEMPLATES = (
+    '/api/v2/banner/{}',
+    '/api/v2/group/{}/banners',
+    '/api/v2/internal/banner/{}/info',
+    '/api/v2/slot/{}/groups',
+    '/api/1/photogenic_banners/list/?server_name=WIN{}',
+    '/export/appinstall_raw/2017-06-{}/',
+)
+"""URL templates of synthetic log lines (formatted with URL number)"""
+URL_METHODS = ('GET', 'GET', 'POST', 'GET', 'HEAD', 'GET', 'GET')
+"""Request methods of synthetic log lines (chosen by URL number)"""
+LOG_DATE = date(2017, 6, 30)
+"""Date of synthetic log"""
+
+
+def generate_line(rnd, request, timestamp):
+    """
+    Generate single nginx log line in `log_analyzer` format
+
+    Args:
+        rnd (random.Random): Random generator
+        request (str): Request (`METHOD url PROTOCOL`)
+        timestamp (datetime.datetime): Request time
+
+    Returns:
+        str: Log line
+    """
+    return '{ip} {user}  - [{time}] "{request}" {status} {size} "-" "{agent}" ' \
+           '"-" "{request_id}" "{rb_user}" {request_time:.3f}\n'.format(
+               ip='1.{}.{}.{}'.format(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)),
+               user=rnd.choice(('-', '3b81f63526fa8')),
+               time=timestamp.strftime('%d/%b/%Y:%H:%M:%S +0300'),
+               request=request,
+               status=rnd.choice((200, 200, 200, 302, 404)),
+               size=rnd.randrange(100000),
+               agent=rnd.choice(USER_AGENTS),
+               request_id='{}-{}-4708-{}'.format(int(timestamp.timestamp()),
+                                                 rnd.randrange(10 ** 10), rnd.randrange(10 ** 7)),
+               rb_user=rnd.choice(('-', 'dc7161be3', '712e90144abee9')),
+               request_time=rnd.lognormvariate(-1.5, 1.0),
+           )
+
+
+def generate_log(path, lines, urls, error_rate=0.0, seed=0):
+    """
+    Generate synthetic nginx log (gzipped if path ends with `.gz`)
+
+    Every distinct URL has its own method, so number of distinct requests equals `urls`.
+    URL popularity follows Zipf-like distribution: i-th URL is requested 1/i times as often
+    as the most popular one.
+
+    Args:
+        path (pathlib.Path): Log file path
+        lines (int): Number of lines
+        urls (int): Number of distinct URLs
+        error_rate (float): Share of broken lines
+        seed (int): Random seed
+
+    Returns:
+        pathlib.Path: Log file path
+    """
+    rnd = random.Random(seed)
+    url_list = [
+        '{} {} HTTP/1.1'.format(URL_METHODS[i % len(URL_METHODS)],
+                                URL_TEMPLATES[i % len(URL_TEMPLATES)].format(i))
+        for i in range(urls)
+    ]
+    weights = [1.0 / (i + 1) for i in range(urls)]
+    timestamp = datetime.combine(LOG_DATE, datetime.min.time())
+    step = timedelta(seconds=86400 / max(lines, 1))
+
+    if path.suffix == '.gz':
+        f = gzip.open(str(path), 'wt', encoding='utf-8')
+    else:
+        f = open(str(path), 'w', encoding='utf-8')
+    with f:
+        chunk = 10000
+        for start in range(0, lines, chunk):
+            count = min(chunk, lines - start)
+            for url in rnd.choices(url_list, weights, k=count):
+                if rnd.random() < error_rate:
+                    f.write('error line\n')
+                else:
+                    f.write(generate_line(rnd, url, timestamp))
+                timestamp += step
+    return path
+
+
+def load_lines(path, count):
+    """
+    Load log file lines and repeat them to get required number of lines
+
+    Args:
+        path (str): Log file path
+        count (int): Number of lines
+
+    Returns:
+        list: Log file lines
+    """
+    with open(path, encoding='utf-8') as f:
+        lines = f.readlines()
+    return (lines * (count // len(lines) + 1))[:count]
+
+
+def benchmark_parser(parser, lines, repeat=3):
+    """
+    Measure parser throughput
+
+    Args:
+        parser (callable): Line parser
+        lines (list): Log file lines
+        repeat (int): Number of measurements (best one is used)
+
+    Returns:
+        float: Lines per second
+    """
+    timer = timeit.Timer(lambda: [parser(line) for line in lines])
+    return len(lines) / min(timer.repeat(repeat=repeat, number=1))
+
+
+def benchmark_parse_line(path, count):
+    """
+    Compare line parsers throughput
+
+    Args:
+        path (str): Log file path
+        count (int): Number of lines
+
+    Returns:
+        dict: Lines per second by parser name
+    """
+    lines = load_lines(path, count)
+    binary_lines = [line.encode('utf-8') for line in lines]
+    return {
+        'regex': benchmark_parser(la.parse_line_regex, lines),
+        'tokenizer': benchmark_parser(la.parse_line, lines),
+        'bytes': benchmark_parser(la.parse_line_bytes, binary_lines),
+    }
+
+
+def benchmark_report(path, options):
+    """
+    Measure `extract_info_from_file` and `prepare_report_data` (run in separate process,
+    so that peak RSS belongs to this benchmark only)
+
+    Args:
+        path (str): Log file path
+        options (dict): `extract_info_from_file` keyword arguments and `report_size`
+
+    Returns:
+        dict: Benchmark results
+    """
+    options = dict(options)
+    report_size = options.pop('report_size')
+    log_file = la.LogFile(pathlib.Path(path), LOG_DATE, '.gz' if path.endswith('.gz') else '')
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    requests = la.extract_info_from_file(log_file, 100, **options)
+    extract_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    la.prepare_report_data(requests, report_size)
+    report_time = time.perf_counter() - start
+
+    with la.open_log_file(log_file) as f:
+        lines = sum(len(block) for block in la.read_blocks(f))
+    return {
+        'lines': lines,
+        'urls': len(requests),
+        'extract_time': extract_time,
+        'report_time': report_time,
+        'total_time': extract_time + report_time,
+        'lines_per_sec': lines / extract_time,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'rss_before_mb': rss_before / 1024,
+    }
+
+
+def run_benchmarks(lines, urls, aggregates, workers, report_size, tmp_dir, seed=0):
+    """
+    Generate plain and gzipped logs and benchmark report creation for them
+
+    Args:
+        lines (int): Number of log lines
+        urls (int): Number of distinct URLs
+        aggregates (list): Aggregate modes to benchmark
+        workers (list): Numbers of parsing processes to benchmark
+        report_size (int): Maximum report size
+        tmp_dir (pathlib.Path): Directory for generated logs
+        seed (int): Random seed
+
+    Returns:
+        list: Benchmark results
+    """
+    results = []
+    for name in ('nginx-access-ui.log-20170630', 'nginx-access-ui.log-20170630.gz'):
+        path = generate_log(tmp_dir.joinpath(name), lines, urls, seed=seed)
+        for aggregate in aggregates:
+            for worker_count in workers:
+                if path.suffix == '.gz' and worker_count > 1:
+                    continue
+                options = {'workers': worker_count, 'aggregate': aggregate,
+                           'report_size': report_size}
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    result = executor.submit(benchmark_report, str(path), options).result()
+                result.update(file=path.name, **options)
+                results.append(result)
+    return results
+
+
+def print_results(results):
+    """
+    Print benchmark results table
+
+    Args:
+        results (list): Benchmark results
+    """
+    header = '{:<34} {:>8} {:>7} {:>12} {:>9} {:>9} {:>9} {:>9}'
+    row = '{file:<34} {aggregate:>8} {workers:>7} {lines_per_sec:>12.0f} {extract_time:>9.2f} ' \
+          '{report_time:>9.2f} {total_time:>9.2f} {peak_rss_mb:>9.1f}'
+    print(header.format('file', 'mode', 'workers', 'lines/sec', 'extract,s', 'report,s',
+                        'total,s', 'rss,MB'))
+    for result in results:
+        print(row.format(**result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Log Analyzer benchmark')
+    subparsers = parser.add_subparsers(dest='command')
+
+    parse_line_parser = subparsers.add_parser('parse-line', help='Compare line parsers')
+    parse_line_parser.add_argument('--log', default='./log/test_log',
+                                   help='Path to sample log file')
+    parse_line_parser.add_argument('--lines', type=int, default=200000,
+                                   help='Number of parsed lines')
+
+    generate_parser = subparsers.add_parser('generate', help='Generate synthetic log')
+    generate_parser.add_argument('path', help='Log file path (gzipped if ends with .gz)')
+    generate_parser.add_argument('--lines', type=int, default=100000, help='Number of lines')
+    generate_parser.add_argument('--urls', type=int, default=1000,
+                                 help='Number of distinct URLs')
+    generate_parser.add_argument('--error-rate', type=float, default=0.0,
+                                 help='Share of broken lines')
+    generate_parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    report_parser = subparsers.add_parser('report', help='Benchmark report creation')
+    report_parser.add_argument('--lines', type=int, default=100000, help='Number of lines')
+    report_parser.add_argument('--urls', type=int, default=1000, help='Number of distinct URLs')
+    report_parser.add_argument('--aggregate', nargs='+', default=['list'],
+                               help='Aggregate modes')
+    report_parser.add_argument('--workers', type=int, nargs='+', default=[1],
+                               help='Numbers of parsing processes')
+    report_parser.add_argument('--report-size', type=int, default=1000,
+                               help='Maximum report size')
+    report_parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    report_parser.add_argument('--output', help='Save results to JSON file')
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        generate_log(pathlib.Path(args.path), args.lines, args.urls, args.error_rate, args.seed)
+    elif args.command == 'report':
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results = run_benchmarks(args.lines, args.urls, args.aggregate, args.workers,
+                                     args.report_size, pathlib.Path(tmp_dir), args.seed)
+        print_results(results)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+    else:
+        log = getattr(args, 'log', './log/test_log')
+        lines = getattr(args, 'lines', 200000)
+        results = benchmark_parse_line(log, lines)
+        for name, speed in results.items():
+            print('{:<10} {:>12.0f} lines/sec'.format(name, speed))
+        for name in ('tokenizer', 'bytes'):
+            print('{:<10} {:>12.2f}x'.format(name, results[name] / results['regex']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+from array import array
+from collections import namedtuple
+import json
+import mmap
+import os
+import shutil
+import sys
+
+
+COLUMNS_VERSION = 1
+"""Version of columnar storage format"""
+COLUMNS_META_NAME = 'meta.json'
+"""Name of file with table metadata, dictionaries and schema"""
+COLUMN_FLUSH_ROWS = 64 * 1024
+"""Number of rows buffered in memory before they are appended to column files"""
+DICTIONARY_TYPECODE = 'I'
+"""Array type of dictionary-encoded string column (index of value in dictionary)"""
+ColumnTable = namedtuple('ColumnTable', ['meta', 'rows', 'columns', 'dictionaries'])
+"""
+Loaded columnar table
+`columns` maps column name to `memoryview` of memory-mapped column file (or `array` if file
+has different byte order), `dictionaries` maps string column name to list of its values
+"""
+
+
+class ColumnWriter:
+    """
+    Writer of columnar table: every column is a file of raw `array` items, string columns
+    are dictionary-encoded. Table is written to temporary directory which replaces target
+    directory only when writer is closed without error, so incomplete tables are never read
+    """
+    def __init__(self, path, schema):
+        """
+        Args:
+            path (pathlib.Path): Table directory path
+            schema (tuple): Pairs of column name and `array` typecode (`str` for strings)
+        """
+        self.path = path
+        self.tmp_path = path.with_name(path.name + '.tmp')
+        self.schema = schema
+        self.meta = {}
+        self.rows = 0
+        self.pending = []
+        self.dictionaries = {name: {} for name, typecode in schema if typecode == 'str'}
+
+        if self.tmp_path.exists():
+            shutil.rmtree(str(self.tmp_path))
+        self.tmp_path.mkdir(parents=True)
+        self.files = [open(str(self.tmp_path.joinpath(name + '.bin')), 'wb')
+                      for name, _ in schema]
+
+    def append(self, row):
+        """
+        Add row (rows are buffered and transposed to columns in batches)
+
+        Args:
+            row (tuple): Column values in schema order
+        """
+        self.pending.append(row)
+        if len(self.pending) >= COLUMN_FLUSH_ROWS:
+            self._flush()
+
+    def _flush(self):
+        """Append buffered rows to column files"""
+        if not self.pending:
+            return
+        columns = zip(*self.pending)
+        for (name, typecode), values, f in zip(self.schema, columns, self.files):
+            if typecode == 'str':
+                dictionary = self.dictionaries[name]
+                for value in dict.fromkeys(values):
+                    if value not in dictionary:
+                        dictionary[value] = len(dictionary)
+                values = array(DICTIONARY_TYPECODE, map(dictionary.__getitem__, values))
+            else:
+                values = array(typecode, values)
+            values.tofile(f)
+        self.rows += len(self.pending)
+        self.pending = []
+
+    def close(self):
+        """Write buffered rows and metadata and replace table directory"""
+        self._flush()
+        for f in self.files:
+            f.close()
+        meta = {
+            'version': COLUMNS_VERSION,
+            'rows': self.rows,
+            'byteorder': sys.byteorder,
+            'schema': [[name, typecode, array(DICTIONARY_TYPECODE if typecode == 'str'
+                                              else typecode).itemsize]
+                       for name, typecode in self.schema],
+            'dictionaries': {name: list(dictionary)
+                             for name, dictionary in self.dictionaries.items()},
+            'meta': self.meta,
+        }
+        with open(str(self.tmp_path.joinpath(COLUMNS_META_NAME)), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        if self.path.exists():
+            shutil.rmtree(str(self.path))
+        os.replace(str(self.tmp_path), str(self.path))
+
+    def abort(self):
+        """Remove incomplete table"""
+        for f in self.files:
+            f.close()
+        shutil.rmtree(str(self.tmp_path), ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def load_column(path, typecode, rows, byteorder):
+    """
+    Load column file without copying (memory map cast to column type)
+
+    Args:
+        path (pathlib.Path): Column file path
+        typecode (str): `array` typecode
+        rows (int): Number of rows
+        byteorder (str): Byte order of file
+
+    Returns:
+        memoryview|array: Column values
+    """
+    if not rows or byteorder != sys.byteorder:
+        values = array(typecode)
+        with open(str(path), 'rb') as f:
+            values.fromfile(f, rows)
+        if byteorder != sys.byteorder:
+            values.byteswap()
+        return values
+
+    with open(str(path), 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    values = memoryview(mm).cast(typecode)
+    if len(values) != rows:
+        raise ValueError('Column "{}" has {} rows instead of {}'.format(path, len(values), rows))
+    return values
+
+
+def load_columns(path):
+    """
+    Load columnar table written by `ColumnWriter`
+
+    Args:
+        path (pathlib.Path): Table directory path
+
+    Returns:
+        ColumnTable: Table or None if it does not exist or has unsupported format
+    """
+    try:
+        with open(str(path.joinpath(COLUMNS_META_NAME)), encoding='utf-8') as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if meta.get('version') != COLUMNS_VERSION:
+        return None
+
+    columns = {}
+    for name, typecode, itemsize in meta['schema']:
+        if typecode == 'str':
+            typecode = DICTIONARY_TYPECODE
+        if array(typecode).itemsize != itemsize:
+            return None
+        try:
+            columns[name] = load_column(path.joinpath(name + '.bin'), typecode, meta['rows'],
+                                        meta['byteorder'])
+        except (OSError, ValueError):
+            return None
+    return ColumnTable(meta['meta'], meta['rows'], columns, meta['dictionaries'])
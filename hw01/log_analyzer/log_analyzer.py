@@ -1,13 +1,28 @@
 import argparse
 from collections import defaultdict, namedtuple
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache
 import gzip
+import heapq
+from itertools import chain, islice
 import json
 import logging
-from operator import itemgetter
+import mmap
+import os
 import pathlib
+import pickle
+import queue
+import random
 import re
-from statistics import median
+import shutil
+import subprocess
+import threading
+import time
+
+from aggregates import get_count, get_median, get_percentiles, get_stats_factory, get_summary
+from columns import ColumnWriter, load_columns
 
 
 DEFAULT_CONFIG_PATH = './config.json'
@@ -18,6 +33,26 @@ DEFAULT_CONFIG = {
     'LOG_DIR': './log',
     'LOG_FILE': None,
     'ERROR_PERCENT': 10,
+    'ERROR_CHECK_LINES': 10000,
+    'WORKERS': 1,
+    'AGGREGATE': 'list',
+    'SKETCH_ACCURACY': 0.01,
+    'GZIP_READER': 'gzip',
+    'SAVE_STATE': False,
+    'ROLLUP_DAYS': 0,
+    'BACKFILL': False,
+    'DATE_FROM': None,
+    'DATE_TO': None,
+    'URL_STRIP_QUERY': False,
+    'URL_COLLAPSE_IDS': False,
+    'URL_RULES': [],
+    'URL_LIMIT': 0,
+    'PERCENTILES': [],
+    'FOLLOW': False,
+    'FOLLOW_LOG': 'nginx-access-ui.log',
+    'FOLLOW_REPORT': 'report-live.html',
+    'FOLLOW_INTERVAL': 60,
+    'EXPORT_DIR': None,
 }
 """Program default configuration"""
 LOG_FILE_MASK = re.compile(r'^nginx-access-ui\.log-(\d{8})(\.gz)?$')
@@ -56,10 +91,84 @@ $body_bytes_sent
 $request_time
 ```
 """
+LOG_LINE_MASK_BYTES = re.compile(LOG_LINE_MASK.pattern.encode())
+"""Log file correct line pattern for binary lines"""
+LOG_LINE_HEAD = re.compile(r'[\d\.]+\s\S*\s+\S*\s\[')
+"""Log file line start pattern (up to `[$time_local]`) checked by tokenizer"""
+LOG_LINE_HEAD_BYTES = re.compile(LOG_LINE_HEAD.pattern.encode())
+"""Log file line start pattern for binary lines"""
+LOG_LINE_FIELDS = 13
+"""Number of parts of correct log file line split by quotes (6 quoted fields)"""
+READ_BLOCK_SIZE = 64 * 1024
+"""Size of block read from log file at once"""
+READ_QUEUE_SIZE = 64
+"""Maximum number of decompressed blocks waiting for parser"""
+ERROR_CHECK_LINES = 10000
+"""Number of lines in error budget pre-check sample and interval between running checks"""
+ERROR_SAMPLE_CHUNKS = 10
+"""Number of random offsets of uncompressed log sampled by error budget pre-check"""
+ERROR_CONFIDENCE_Z = 4.0
+"""
+Z-score of confidence interval of errors rate used to abort parsing early (high enough to keep
+false aborts negligible although running check is repeated many times)
+"""
+GZIP_COMMANDS = (['pigz', '-dc'], ['gzip', '-dc'])
+"""External decompressors (in order of preference)"""
+STATE_VERSION = 2
+"""Version of saved aggregate state format"""
+URL_UUID_RULE = (re.compile(r'/[0-9a-fA-F]{8}(?:-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}(?=/|$)'),
+                 '/{uuid}')
+"""URL normalization rule collapsing UUID path segments"""
+URL_ID_RULE = (re.compile(r'/\d+(?=/|$)'), '/{id}')
+"""URL normalization rule collapsing numeric path segments"""
+URL_CACHE_SIZE = 100000
+"""Maximum number of cached normalized URLs"""
+OTHER_URL = 'other'
+"""URL of bucket for rare URLs folded when URLs limit is exceeded"""
+FOLLOW_POLL_INTERVAL = 1.0
+"""Delay (seconds) before next read when live log has no new lines"""
+FOLLOW_READ_SIZE = 16 * 1024 * 1024
+"""Maximum number of bytes read from live log at once"""
+LOG_TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+"""Format of `$time_local` field"""
+LOG_TIME_CACHE_SIZE = 64
+"""Maximum number of cached parsed dates of `$time_local` field"""
+EXPORT_SCHEMA = (('timestamp', 'q'), ('url', 'str'), ('status', 'H'), ('bytes', 'q'),
+                 ('request_time', 'd'))
+"""Columns of exported log records (see `columns.ColumnWriter`)"""
+REPORT_TEMPLATE_PATH = 'report.html'
+"""Report template file path"""
+REPORT_TABLE_MARKER = '$table_json'
+"""Marker replaced with report data in report template"""
 LogFile = namedtuple('LogFile', ['path', 'date', 'ext'])
 """Log file data structure"""
 LogLine = namedtuple('LogLine', ['url', 'request_time'])
 """Log file line data structure"""
+LogRecord = namedtuple('LogRecord', ['timestamp', 'url', 'status', 'bytes', 'request_time'])
+"""
+Exported log file line data structure
+`timestamp` is Unix time of request, `bytes` is response body size (0 if not logged)
+"""
+AggregateOptions = namedtuple('AggregateOptions', ['stats_factory', 'normalize_url',
+                                                   'url_limit', 'error_percent',
+                                                   'error_check_lines'],
+                              defaults=(None, ERROR_CHECK_LINES))
+"""
+Aggregation options
+`stats_factory` is factory of per-URL request times container, `normalize_url` is URL
+normalization function (or None), `url_limit` is maximum number of distinct URLs (0 - unlimited),
+`error_percent` is error max percent checked while parsing (None - no running check),
+`error_check_lines` is minimum number of lines between running checks
+"""
+DEFAULT_AGGREGATE_OPTIONS = AggregateOptions(list, None, 0)
+"""Default aggregation options"""
+LogState = namedtuple('LogState', ['path', 'date', 'signature', 'offset', 'lines', 'fails',
+                                   'aggregate', 'requests'])
+"""
+Saved aggregate state of log file
+`signature` is log file size and modification time at the moment of parsing, `offset` is
+position (in uncompressed data) after the last parsed line
+"""
 
 
 def get_config_path():
@@ -116,6 +225,51 @@ def get_latest_log_file(log_dir):
     """
     Find latest (with biggest date in name) log file
 
+    Args:
+        log_dir (pathlib.Path): Log files directory path
+
+    Returns:
+        LogFile: Log file
+
+    Raises:
+        FileNotFoundError: If log directory does not exists or is not directory
+    """
+    log_file = None
+    for current_log_file in find_log_files(log_dir):
+        if not log_file or log_file.date < current_log_file.date:
+            log_file = current_log_file
+
+    return log_file
+
+
+def get_log_files(log_dir, date_from=None, date_to=None):
+    """
+    Find log files for date range (one file per date)
+
+    Args:
+        log_dir (pathlib.Path): Log files directory path
+        date_from (datetime.date): First date of range (unlimited if not set)
+        date_to (datetime.date): Last date of range (unlimited if not set)
+
+    Returns:
+        list: Log files sorted by date
+
+    Raises:
+        FileNotFoundError: If log directory does not exists or is not directory
+    """
+    log_files = {}
+    for log_file in find_log_files(log_dir):
+        if date_from and log_file.date < date_from or date_to and log_file.date > date_to:
+            continue
+        log_files.setdefault(log_file.date, log_file)
+
+    return [log_files[log_date] for log_date in sorted(log_files)]
+
+
+def find_log_files(log_dir):
+    """
+    Find all log files in directory
+
     Args:
         log_dir (pathlib.Path): Log files directory path
 
@@ -128,7 +282,6 @@ def get_latest_log_file(log_dir):
     if not (log_dir.exists() and log_dir.is_dir()):
         raise FileNotFoundError('Log directory does not exists')
 
-    log_file = None
     for path in log_dir.iterdir():
         matches = re.findall(LOG_FILE_MASK, path.name)
         if not matches:
@@ -140,10 +293,7 @@ def get_latest_log_file(log_dir):
         except ValueError:
             continue
 
-        if not log_file or log_file.date < log_date:
-            log_file = LogFile(path, log_date, ext)
-
-    return log_file
+        yield LogFile(path, log_date, ext)
 
 
 def get_report_path(log_file, report_dir):
@@ -168,9 +318,59 @@ def get_report_path(log_file, report_dir):
     return report_path
 
 
+def tokenize_line(line):
+    """
+    Extract request and request time from log file line without full line regular expression
+
+    Line is split by quotes: request is the first quoted field and request time is the last
+    field after closing quote of `$http_X_RB_USER`. Unquoted fields are checked cheaply
+    (`LOG_LINE_HEAD` and `[time]` before request, `status bytes` after it, single spaces
+    between quoted fields), so that line is accepted only if `LOG_LINE_MASK` accepts it too
+    (lines with other structure are left to regular expression).
+
+    Args:
+        line (str): Log file line
+
+    Returns:
+        LogLine: Request data or None if line does not have expected structure
+    """
+    fields = line.split('"')
+    if len(fields) != LOG_LINE_FIELDS:
+        return None
+    url = fields[1]
+    values = fields[2].split(' ')
+    request_time = fields[-1][1:].rstrip()
+
+    whole, dot, fraction = request_time.partition('.')
+    if not (url and dot and whole.isdecimal() and fraction.isdecimal() and fields[-1][:1] == ' '
+            and fields[0].endswith('] ') and LOG_LINE_HEAD.match(fields[0])
+            and len(values) == 4 and values[1].isdecimal() and values[2].isdecimal()
+            and not values[0] and not values[3]
+            and fields[4] == fields[6] == fields[8] == fields[10] == ' '):
+        return None
+    return LogLine(url, float(request_time))
+
+
 def parse_line(line):
     """
-    Parse log file single line
+    Parse log file single line (with fast tokenizer, falling back to regular expression
+    for malformed lines)
+
+    Args:
+        line (str): Log file line
+
+    Returns:
+        LogLine: Request data
+    """
+    request = tokenize_line(line)
+    if request:
+        return request
+    return parse_line_regex(line)
+
+
+def parse_line_regex(line):
+    """
+    Parse log file single line with regular expression
 
     Args:
         line (str): Log file line
@@ -189,146 +389,1648 @@ def parse_line(line):
     return LogLine(url, float(request_time))
 
 
-def parse_log_file(log_file):
+def tokenize_line_bytes(line):
     """
-    Parse log file and extract information about requests line by line
+    Extract request and request time from binary log file line without full line regular
+    expression (unquoted fields are checked like in `tokenize_line`). Only request is decoded
+    to string
 
     Args:
-        log_file (LogFile): Log file
+        line (bytes): Log file line
 
     Returns:
-        LogLine: Single request data
+        LogLine: Request data or None if line does not have expected structure
+
+    Raises:
+        UnicodeDecodeError: If request is not valid UTF-8
     """
-    if log_file.ext == '.gz':
-        f = gzip.open(log_file.path.absolute(), 'rt')
-    else:
-        f = open(str(log_file.path), encoding='utf-8')
+    fields = line.split(b'"')
+    if len(fields) != LOG_LINE_FIELDS:
+        return None
+    url = fields[1]
+    values = fields[2].split(b' ')
+    request_time = fields[-1][1:].rstrip()
+
+    whole, dot, fraction = request_time.partition(b'.')
+    if not (url and dot and whole.isdigit() and fraction.isdigit() and fields[-1][:1] == b' '
+            and fields[0].endswith(b'] ') and LOG_LINE_HEAD_BYTES.match(fields[0])
+            and len(values) == 4 and values[1].isdigit() and values[2].isdigit()
+            and not values[0] and not values[3]
+            and fields[4] == fields[6] == fields[8] == fields[10] == b' '):
+        return None
+    return LogLine(url.decode('utf-8'), float(request_time))
+
 
-    with f:
-        for line in f:
-            yield parse_line(line)
+def parse_line_bytes(line):
+    """
+    Parse binary log file single line (with fast tokenizer, falling back to regular
+    expression for malformed lines)
 
+    Args:
+        line (bytes): Log file line
 
-def extract_info_from_file(log_file, error_percent):
+    Returns:
+        LogLine: Request data or None for broken line
     """
-    Extract information about requests from log file
+    try:
+        request = tokenize_line_bytes(line)
+        if request:
+            return request
+
+        match = LOG_LINE_MASK_BYTES.findall(line)
+        if not match:
+            return None
+        url = match[0][4].decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+
+    request_time = match[0][-1]
+    if not (url and request_time):
+        return None
+    return LogLine(url, float(request_time))
+
+
+@lru_cache(maxsize=LOG_TIME_CACHE_SIZE)
+def parse_log_day(day, zone):
+    """
+    Get Unix time of local midnight
 
     Args:
-        log_file (LogFile): Log file
-        error_percent (float): Error max percent
+        day (bytes): Date part of `$time_local` field, e.g. `29/Jun/2017`
+        zone (bytes): Time zone part of `$time_local` field, e.g. `+0300`
 
     Returns:
-        dict: Request data
+        int: Unix time
 
     Raises:
-        ValueError: If log errors limit was exceeded
+        ValueError: If value has wrong format
     """
-    lines = 0
-    fails = 0
-    requests = defaultdict(list)
-    for request in parse_log_file(log_file):
-        lines += 1
-        if request:
-            requests[request.url].append(request.request_time)
-        else:
-            fails += 1
+    value = '{}:00:00:00 {}'.format(day.decode('ascii'), zone.decode('ascii'))
+    return int(datetime.strptime(value, LOG_TIME_FORMAT).timestamp())
 
-    # Check error percentage
-    errors = 100 * fails / lines
-    if errors > error_percent:
-        raise ValueError('Log errors limit was exceeded. Error percent {}% more than {}%'.format(
-            errors, error_percent
-        ))
-    return requests
 
+def parse_log_time(value):
+    """
+    Parse `$time_local` field (only time of day is parsed per line, dates are cached)
+
+    Args:
+        value (bytes): Field value, e.g. `29/Jun/2017:03:50:22 +0300`
+
+    Returns:
+        int: Unix time
 
-def prepare_report_data(requests, report_size):
+    Raises:
+        ValueError: If value has wrong format
     """
-    Process request statistics and generate report data
+    day, _, rest = value.partition(b':')
+    clock, _, zone = rest.partition(b' ')
+    hours, minutes, seconds = clock.split(b':')
+    return parse_log_day(day, zone) + int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def tokenize_record_bytes(line):
+    """
+    Extract all exported fields from binary log file line without regular expression
 
     Args:
-        requests (dict) :
-        report_size (int): Maximum report size
+        line (bytes): Log file line
 
     Returns:
-        List: Report data
+        LogRecord: Request data or None if line does not have expected structure
+
+    Raises:
+        ValueError: If request is not valid UTF-8 or time has wrong format
     """
-    total_count = 0
-    total_time = 0.0
-    for request_times in requests.values():
-        total_count += len(request_times)
-        total_time += sum(request_times)
+    fields = line.split(b'"')
+    if len(fields) != LOG_LINE_FIELDS:
+        return None
+    head = fields[0]
+    time_start = head.find(b'[') + 1
+    time_end = head.find(b']', time_start)
+    url = fields[1]
+    values = fields[2].split()
+    request_time = fields[-1].strip()
+
+    whole, dot, fraction = request_time.partition(b'.')
+    if not (url and time_start and time_end > 0 and len(values) == 2 and values[0].isdigit()
+            and dot and whole.isdigit() and fraction.isdigit()):
+        return None
+    return LogRecord(parse_log_time(head[time_start:time_end]), url.decode('utf-8'),
+                     int(values[0]), int(values[1]) if values[1].isdigit() else 0,
+                     float(request_time))
 
-    report_data = []
-    for url, request_times in requests.items():
-        request_count = len(request_times)
-        request_time = sum(request_times)
-        report_data.append({
-            'url': url,
-            'count': request_count,
-            'count_perc': round(100.0 * request_count / float(total_count), 3),
-            'time_sum': round(sum(request_times), 3),
-            'time_perc': round(100.0 * request_time / total_time, 3),
-            'time_avg': round(request_time / request_count, 3),
-            'time_max': round(max(request_times), 3),
-            'time_med': round(median(request_times), 3),
-        })
-    report_data = sorted(report_data, key=itemgetter('time_sum'), reverse=True)
-    report_data = report_data[:report_size]
 
-    return report_data
+def parse_record_bytes(line):
+    """
+    Parse binary log file single line with all exported fields (with fast tokenizer, falling
+    back to regular expression for malformed lines)
 
+    Args:
+        line (bytes): Log file line
 
-def create_report(report_data, report_dir, log_date):
+    Returns:
+        LogRecord: Request data or None for broken line
     """
-    Save report data to HTML file
+    try:
+        record = tokenize_record_bytes(line)
+        if record:
+            return record
+
+        match = LOG_LINE_MASK_BYTES.findall(line)
+        if not match:
+            return None
+        fields = match[0]
+        url = fields[4].decode('utf-8')
+        if not (url and fields[-1]):
+            return None
+        return LogRecord(parse_log_time(fields[3]), url, int(fields[5]),
+                         int(fields[6]) if fields[6].isdigit() else 0, float(fields[-1]))
+    except ValueError:
+        # Includes UnicodeDecodeError
+        return None
+
+
+def read_blocks(f, size=None, block_size=READ_BLOCK_SIZE, partial=True):
+    """
+    Read binary file by large blocks and split them into lines
 
     Args:
-        report_data (list): Report data
-        report_dir (pathlib.Path): Report directory path
-        log_date (datetime.date): Log file data
+        f (file): Binary file object
+        size (int): Number of bytes to read (till the end of file if not set)
+        block_size (int): Size of block read at once
+        partial (bool): Whether to return last line without line separator
 
     Returns:
-        pathlib.Path: Report file path
+        list: Lines of single block without line separators
     """
-    report_date = log_date.strftime('%Y.%m.%d')
-    report_path = report_dir.joinpath('report-{}.html'.format(report_date))
+    tail = b''
+    while size is None or size > 0:
+        block = f.read(block_size if size is None else min(block_size, size))
+        if not block:
+            break
+        if size is not None:
+            size -= len(block)
+
+        lines = (tail + block).split(b'\n')
+        tail = lines.pop()
+        yield lines
+    if tail and partial:
+        yield [tail]
+
+
+def read_mapped_blocks(path, start=0, end=None, block_size=READ_BLOCK_SIZE):
+    """
+    Read uncompressed file through memory map and split it into lines. Blocks are cut at
+    the last line separator found in the mapping, so there is no read buffer copying and no
+    gluing of line parts between blocks
 
-    with open('report.html', 'r', encoding='utf-8') as f:
-        template = f.read()
-        template = template.replace('$table_json', json.dumps(report_data))
-    with open(str(report_path), 'w', encoding='utf-8') as f:
-        f.write(template)
+    Args:
+        path (str): File path
+        start (int): Start offset (beginning of line)
+        end (int): End offset (beginning of line or end of file if not set)
+        block_size (int): Approximate size of block split at once
 
-    return report_path
+    Returns:
+        list: Lines of single block without line separators
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            position = start
+            while position < end:
+                block_end = min(position + block_size, end)
+                if block_end < end:
+                    index = mm.rfind(b'\n', position, block_end)
+                    if index < 0:
+                        index = mm.find(b'\n', block_end, end)
+                    block_end = end if index < 0 else index + 1
+                lines = mm[position:block_end].split(b'\n')
+                if not lines[-1]:
+                    lines.pop()
+                yield lines
+                position = block_end
+
+
+def skip_bytes(f, size, block_size=READ_BLOCK_SIZE):
+    """
+    Move binary file position forward (by seeking or reading for non-seekable streams)
 
+    Args:
+        f (file): Binary file object
+        size (int): Number of bytes to skip
+        block_size (int): Size of block read at once
+    """
+    if getattr(f, 'seekable', None) and f.seekable():
+        f.seek(size)
+        return
+    while size > 0:
+        block = f.read(min(block_size, size))
+        if not block:
+            break
+        size -= len(block)
 
-def main():
-    config = load_config()
-    setup_logger(config.get('LOG_FILE'))
 
-    # 1. Get log file instance
-    log_dir = pathlib.Path(config.get('LOG_DIR'))
-    log_file = get_latest_log_file(log_dir)
-    if not log_file:
-        logging.info('No logs in "{}"'.format(log_file))
+class ThreadedReader:
+    """
+    Binary file reader which reads source file in background thread and passes blocks
+    through bounded queue, so reading (and decompression) overlaps with parsing
+    """
+    def __init__(self, f, block_size=READ_BLOCK_SIZE, queue_size=READ_QUEUE_SIZE):
+        self.f = f
+        self.block_size = block_size
+        self.queue = queue.Queue(queue_size)
+        self.buffer = b''
+        self.eof = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._read_source, daemon=True)
+        self.thread.start()
+
+    def _read_source(self):
+        """Read source file and put blocks to queue (empty block means end of file)"""
+        try:
+            while not self.stopped.is_set():
+                block = self.f.read(self.block_size)
+                self.queue.put(block)
+                if not block:
+                    break
+        except Exception as e:
+            self.queue.put(e)
+
+    def _next_block(self):
+        """
+        Get next block from queue
+
+        Returns:
+            bytes: Block (empty at the end of file)
+
+        Raises:
+            Exception: Exception raised while reading source file
+        """
+        block = self.queue.get()
+        if isinstance(block, Exception):
+            self.eof = True
+            raise block
+        if not block:
+            self.eof = True
+        return block
+
+    def read(self, size=-1):
+        """
+        Read up to `size` bytes
+
+        Args:
+            size (int): Number of bytes (till the end of file if negative)
+
+        Returns:
+            bytes: Data (empty at the end of file)
+        """
+        if size < 0 or len(self.buffer) < size:
+            chunks = [self.buffer]
+            length = len(self.buffer)
+            while not self.eof and (size < 0 or length < size):
+                block = self._next_block()
+                chunks.append(block)
+                length += len(block)
+            self.buffer = b''.join(chunks)
+        if size < 0:
+            size = len(self.buffer)
+
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+    def close(self):
+        """Stop background thread and close source file"""
+        self.stopped.set()
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+@contextmanager
+def open_gzip_process(path):
+    """
+    Open gzip file decompressed by external process (`pigz` or `gzip`)
+
+    Args:
+        path (str): Log file path
+
+    Returns:
+        file: Binary stream of decompressed data
+
+    Raises:
+        FileNotFoundError: If no external decompressor was found
+        OSError: If decompressor failed
+    """
+    for command in GZIP_COMMANDS:
+        executable = shutil.which(command[0])
+        if executable:
+            break
+    else:
+        raise FileNotFoundError('No external gzip decompressor found')
+
+    process = subprocess.Popen([executable] + command[1:] + [path], stdout=subprocess.PIPE,
+                               bufsize=READ_BLOCK_SIZE)
+    try:
+        yield process.stdout
+    except BaseException:
+        process.terminate()
+        raise
+    finally:
+        process.stdout.close()
+        return_code = process.wait()
+    if return_code:
+        raise OSError('Decompressor "{}" failed with code {}'.format(executable, return_code))
+
+
+def open_log_file(log_file, gzip_reader='gzip'):
+    """
+    Open log file in binary mode
+
+    Gzip readers:
+    - `gzip` - decompress with `gzip` module in parser thread
+    - `thread` - decompress with `gzip` module in background thread
+    - `external` - decompress with external `pigz` (or `gzip`) process, falls back to `thread`
+      if none is installed
+
+    Args:
+        log_file (LogFile): Log file
+        gzip_reader (str): Gzip reader
+
+    Returns:
+        file: Binary file object
+
+    Raises:
+        ValueError: If gzip reader is unknown
+    """
+    if log_file.ext != '.gz':
+        return open(str(log_file.path), 'rb')
+
+    if gzip_reader == 'external':
+        if any(shutil.which(command[0]) for command in GZIP_COMMANDS):
+            return open_gzip_process(str(log_file.path))
+        logging.info('No external gzip decompressor found, using background thread')
+        gzip_reader = 'thread'
+
+    if gzip_reader == 'gzip':
+        return gzip.open(str(log_file.path), 'rb')
+    elif gzip_reader == 'thread':
+        return ThreadedReader(gzip.open(str(log_file.path), 'rb'))
+    raise ValueError('Unknown gzip reader "{}"'.format(gzip_reader))
+
+
+def parse_log_file(log_file, gzip_reader='gzip', parser=parse_line_bytes):
+    """
+    Parse log file and extract information about requests line by line
+
+    Args:
+        log_file (LogFile): Log file
+        gzip_reader (str): Gzip reader (see `open_log_file`)
+        parser (callable): Binary line parser
+
+    Returns:
+        LogLine: Single request data (or other `parser` result)
+    """
+    if log_file.ext != '.gz':
+        yield from parse_log_range(str(log_file.path), 0, parser=parser)
         return
 
-    # 2. Get report file path
-    report_dir = pathlib.Path(config.get('REPORT_DIR'))
-    report_path = get_report_path(log_file, report_dir)
-    if report_path.exists():
-        logging.info('Report for "{}" already exists'.format(log_file.date))
+    with open_log_file(log_file, gzip_reader) as f:
+        for lines in read_blocks(f):
+            for line in lines:
+                yield parser(line)
+
+
+def parse_log_range(path, start, end=None, parser=parse_line_bytes):
+    """
+    Parse part of uncompressed log file between two byte offsets line by line (file is read
+    through memory map)
+
+    Args:
+        path (str): Log file path
+        start (int): Range start offset (beginning of line)
+        end (int): Range end offset (beginning of line or end of file if not set)
+        parser (callable): Binary line parser
+
+    Returns:
+        LogLine: Single request data (or other `parser` result)
+    """
+    for lines in read_mapped_blocks(path, start, end):
+        for line in lines:
+            yield parser(line)
+
+
+def get_log_ranges(log_file, workers, start=0, end=None):
+    """
+    Split uncompressed log file into byte ranges aligned on line boundaries
+
+    Args:
+        log_file (LogFile): Log file
+        workers (int): Number of ranges to split file into
+        start (int): Start offset of split part (beginning of line)
+        end (int): End offset of split part (end of file if not set)
+
+    Returns:
+        list: List of `(start, end)` byte offsets
+    """
+    if end is None:
+        end = log_file.path.stat().st_size
+    bounds = [start]
+    if end - start > 1:
+        with open(str(log_file.path), 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for i in range(1, workers):
+                offset = start + (end - start) * i // workers
+                if offset <= bounds[-1]:
+                    continue
+                index = mm.find(b'\n', offset - 1, end)
+                bounds.append(end if index < 0 else index + 1)
+    bounds.append(end)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+def get_complete_size(path, block_size=READ_BLOCK_SIZE):
+    """
+    Get size of uncompressed file part containing only complete lines
+
+    Args:
+        path (str): File path
+        block_size (int): Size of block read at once
+
+    Returns:
+        int: Offset after the last line separator
+    """
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            index = f.read(step).rfind(b'\n')
+            if index >= 0:
+                return position + index + 1
+    return 0
+
+
+class UrlNormalizer:
+    """
+    Compiled set of URL normalization rules. Rules are applied to path part of request
+    (`METHOD path PROTOCOL`), requests of other structure are left as is
+    """
+    def __init__(self, strip_query=False, collapse_ids=False, rules=()):
+        """
+        Args:
+            strip_query (bool): Whether to remove query string
+            collapse_ids (bool): Whether to replace numeric and UUID path segments with
+                `{id}` and `{uuid}` placeholders
+            rules (list): Additional `[pattern, replacement]` regular expression rules
+        """
+        self.strip_query = strip_query
+        self.collapse_ids = collapse_ids
+        self.rules = [(re.compile(pattern), replacement) for pattern, replacement in rules]
+        self.cache = {}
+
+    def __call__(self, url):
+        """
+        Normalize URL (results are cached, cache is cleared when it becomes too big)
+
+        Args:
+            url (str): Request (`METHOD path PROTOCOL`)
+
+        Returns:
+            str: Normalized request
+        """
+        normalized_url = self.cache.get(url)
+        if normalized_url is None:
+            if len(self.cache) >= URL_CACHE_SIZE:
+                self.cache.clear()
+            normalized_url = self.cache[url] = self._normalize(url)
+        return normalized_url
+
+    def _normalize(self, url):
+        """
+        Normalize URL without cache
+
+        Args:
+            url (str): Request (`METHOD path PROTOCOL`)
+
+        Returns:
+            str: Normalized request
+        """
+        parts = url.split(' ')
+        if len(parts) != 3:
+            return url
+
+        method, path, protocol = parts
+        if self.strip_query:
+            path = path.partition('?')[0]
+        if self.collapse_ids:
+            if '-' in path:
+                path = URL_UUID_RULE[0].sub(URL_UUID_RULE[1], path)
+            path = URL_ID_RULE[0].sub(URL_ID_RULE[1], path)
+        for pattern, replacement in self.rules:
+            path = pattern.sub(replacement, path)
+        return ' '.join((method, path, protocol))
+
+
+def create_url_normalizer(strip_query=False, collapse_ids=False, rules=()):
+    """
+    Create URL normalizer
+
+    Args:
+        strip_query (bool): Whether to remove query string
+        collapse_ids (bool): Whether to collapse numeric and UUID path segments
+        rules (list): Additional `[pattern, replacement]` regular expression rules
+
+    Returns:
+        UrlNormalizer: URL normalizer or None if there are no rules
+    """
+    if not (strip_query or collapse_ids or rules):
+        return None
+    return UrlNormalizer(strip_query, collapse_ids, rules)
+
+
+def fold_rare_urls(requests, url_limit):
+    """
+    Keep `url_limit` most requested URLs and merge request times of others into `other` URL
+
+    Args:
+        requests (dict): Request times by URL
+        url_limit (int): Maximum number of distinct URLs (besides `other`)
+    """
+    if len(requests) - (OTHER_URL in requests) <= url_limit:
         return
 
-    # 3. Extract logs and create report
-    requests = extract_info_from_file(log_file, config.get('ERROR_PERCENT'))
-    report_data = prepare_report_data(requests, config.get('REPORT_SIZE'))
-    report_path = create_report(report_data, report_dir, log_file.date)
+    other = requests.pop(OTHER_URL, None)
+    top_urls = set(heapq.nlargest(url_limit, requests,
+                                  key=lambda url: get_count(requests[url])))
+    for url in [url for url in requests if url not in top_urls]:
+        request_times = requests.pop(url)
+        if other is None:
+            other = request_times
+        else:
+            other.extend(request_times)
+    requests[OTHER_URL] = other
 
-    logging.info('Report "{}" from file "{}" was created successfully'.format(
-        report_path, log_file.path
-    ))
+
+def aggregate_requests(parsed_lines, options=DEFAULT_AGGREGATE_OPTIONS):
+    """
+    Collect request times by URL
+
+    If URLs limit is set, rare URLs are folded into `other` URL every time number of URLs
+    doubles the limit, so URLs which became frequent later may be partially counted as `other`.
+
+    If error max percent is set, errors rate is checked on broken lines at most every
+    `error_check_lines` lines (see `check_error_estimate`).
+
+    Args:
+        parsed_lines (iterable): Parsed lines (`LogLine` or None for broken line)
+        options (AggregateOptions): Aggregation options
+
+    Returns:
+        tuple: Lines count, broken lines count and request times by URL
+
+    Raises:
+        ValueError: If log errors limit is exceeded with high confidence
+    """
+    lines = 0
+    fails = 0
+    requests = defaultdict(options.stats_factory)
+    normalize_url = options.normalize_url
+    fold_limit = 2 * options.url_limit
+    check_lines = options.error_check_lines
+    next_check = check_lines if options.error_percent is not None else float('inf')
+    for request in parsed_lines:
+        lines += 1
+        if not request:
+            fails += 1
+            if lines >= next_check:
+                check_error_estimate(lines, fails, options.error_percent)
+                next_check = lines + check_lines
+            continue
+
+        url = normalize_url(request.url) if normalize_url else request.url
+        requests[url].append(request.request_time)
+        if fold_limit and len(requests) > fold_limit:
+            fold_rare_urls(requests, options.url_limit)
+    return lines, fails, requests
+
+
+def aggregate_log_range(path, start, end, options=DEFAULT_AGGREGATE_OPTIONS):
+    """
+    Collect request times by URL from part of log file (process pool worker)
+
+    Args:
+        path (str): Log file path
+        start (int): Range start offset
+        end (int): Range end offset
+        options (AggregateOptions): Aggregation options
+
+    Returns:
+        tuple: Lines count, broken lines count and request times by URL
+    """
+    return aggregate_requests(parse_log_range(path, start, end), options)
+
+
+def aggregate_log_ranges(path, ranges, workers, options=DEFAULT_AGGREGATE_OPTIONS):
+    """
+    Collect request times by URL from log file ranges in process pool
+
+    Args:
+        path (str): Log file path
+        ranges (list): List of `(start, end)` byte offsets
+        workers (int): Number of parsing processes
+        options (AggregateOptions): Aggregation options
+
+    Returns:
+        tuple: Lines count, broken lines count and request times by URL
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(aggregate_log_range, path, start, end, options)
+                   for start, end in ranges]
+        return merge_requests(future.result() for future in futures)
+
+
+def aggregate_log_stream(log_file, offset, options=DEFAULT_AGGREGATE_OPTIONS,
+                         gzip_reader='gzip'):
+    """
+    Collect request times by URL from complete lines of log file starting at offset
+
+    Args:
+        log_file (LogFile): Log file
+        offset (int): Start position in uncompressed data (beginning of line)
+        options (AggregateOptions): Aggregation options
+        gzip_reader (str): Gzip reader (see `open_log_file`)
+
+    Returns:
+        tuple: Position after the last complete line, lines count, broken lines count and
+            request times by URL
+    """
+    consumed = 0
+
+    def parse():
+        nonlocal consumed
+        with open_log_file(log_file, gzip_reader) as f:
+            skip_bytes(f, offset)
+            for lines in read_blocks(f, partial=False):
+                consumed += sum(map(len, lines)) + len(lines)
+                for line in lines:
+                    yield parse_line_bytes(line)
+
+    lines, fails, requests = aggregate_requests(parse(), options)
+    return offset + consumed, lines, fails, requests
+
+
+def merge_requests(results):
+    """
+    Merge per-range aggregates preserving ranges order (request times containers of the
+    first result are extended in place; it may be a plain dict, e.g. of state of empty log)
+
+    Args:
+        results (iterable): Results of `aggregate_requests` in file order
+
+    Returns:
+        tuple: Lines count, broken lines count and request times by URL
+    """
+    lines = 0
+    fails = 0
+    requests = None
+    for range_lines, range_fails, range_requests in results:
+        lines += range_lines
+        fails += range_fails
+        if requests is None:
+            requests = range_requests
+            continue
+        for url, request_times in range_requests.items():
+            if url in requests:
+                requests[url].extend(request_times)
+            else:
+                requests[url] = request_times
+    return lines, fails, requests if requests is not None else {}
+
+
+def extract_info_from_file(log_file, error_percent, workers=1, aggregate='list',
+                           sketch_accuracy=0.01, gzip_reader='gzip', url_normalizer=None,
+                           url_limit=0, error_check_lines=ERROR_CHECK_LINES):
+    """
+    Extract information about requests from log file
+
+    Uncompressed logs are split into `workers` line-aligned byte ranges which are parsed in
+    a process pool. Per-range results are merged in file order, so report is the same as
+    for single process parsing.
+
+    Log in wrong format is rejected without full parsing: sample of lines is checked first
+    (see `check_error_sample`) and parsing is aborted as soon as errors rate is certain to
+    exceed the limit. Exact errors limit check is done after parsing anyway.
+
+    Aggregate modes:
+    - `list` - keep all request times of URL in list
+    - `exact` - keep request times in compact `array('d')` with running count/max
+    - `sketch` - keep running count/max, exact partial sums and approximate median with
+      logarithmic histogram in constant space (relative error of median does not exceed
+      `sketch_accuracy`)
+
+    Args:
+        log_file (LogFile): Log file
+        error_percent (float): Error max percent
+        workers (int): Number of parsing processes
+        aggregate (str): Aggregate mode
+        sketch_accuracy (float): Relative accuracy of median in `sketch` mode
+        gzip_reader (str): Gzip reader (see `open_log_file`)
+        url_normalizer (callable): URL normalization function (see `create_url_normalizer`)
+        url_limit (int): Maximum number of distinct URLs, others are folded into `other` URL
+            (0 - unlimited)
+        error_check_lines (int): Number of lines in pre-check sample and interval of running
+            checks (0 - no early checks)
+
+    Returns:
+        dict: Request data
+
+    Raises:
+        ValueError: If log errors limit was exceeded
+    """
+    if error_check_lines:
+        check_error_sample(log_file, error_percent, error_check_lines)
+    options = AggregateOptions(get_stats_factory(aggregate, sketch_accuracy), url_normalizer,
+                               url_limit, error_percent if error_check_lines else None,
+                               error_check_lines)
+    if workers > 1 and log_file.ext != '.gz':
+        ranges = get_log_ranges(log_file, workers)
+        lines, fails, requests = aggregate_log_ranges(str(log_file.path), ranges, workers,
+                                                      options)
+    else:
+        lines, fails, requests = aggregate_requests(parse_log_file(log_file, gzip_reader),
+                                                    options)
+
+    check_error_limit(lines, fails, error_percent)
+    if url_limit:
+        fold_rare_urls(requests, url_limit)
+    return requests
+
+
+def get_columns_path(export_dir, log_date):
+    """
+    Generate path of exported log records
+
+    Args:
+        export_dir (pathlib.Path): Export directory path
+        log_date (datetime.date): Log date
+
+    Returns:
+        pathlib.Path: Columnar table directory path
+    """
+    return export_dir.joinpath('columns-{}'.format(log_date.strftime('%Y.%m.%d')))
+
+
+def export_log_file(log_file, columns_path, gzip_reader='gzip'):
+    """
+    Parse log file once and save request records as columnar table (see `EXPORT_SCHEMA`)
+
+    Args:
+        log_file (LogFile): Log file
+        columns_path (pathlib.Path): Columnar table directory path
+        gzip_reader (str): Gzip reader (see `open_log_file`)
+
+    Returns:
+        tuple: Lines count and broken lines count
+    """
+    signature = get_log_signature(log_file)
+    lines = 0
+    fails = 0
+    with ColumnWriter(columns_path, EXPORT_SCHEMA) as writer:
+        for record in parse_log_file(log_file, gzip_reader, parse_record_bytes):
+            lines += 1
+            if not record:
+                fails += 1
+                continue
+            writer.append(record)
+        writer.meta.update(path=str(log_file.path), date=log_file.date.isoformat(),
+                           signature=list(signature), lines=lines, fails=fails)
+    return lines, fails
+
+
+def load_exported_log(log_file, columns_path, gzip_reader='gzip'):
+    """
+    Load exported request records of log file, exporting them first if log was not exported
+    yet or has changed since export
+
+    Args:
+        log_file (LogFile): Log file
+        columns_path (pathlib.Path): Columnar table directory path
+        gzip_reader (str): Gzip reader (see `open_log_file`)
+
+    Returns:
+        columns.ColumnTable: Request records
+    """
+    table = load_columns(columns_path)
+    if table and table.meta.get('signature') == list(get_log_signature(log_file)):
+        return table
+
+    lines, fails = export_log_file(log_file, columns_path, gzip_reader)
+    logging.info('Log file "{}" was exported to "{}": {} lines, {} broken'.format(
+        log_file.path, columns_path, lines, fails
+    ))
+    return load_columns(columns_path)
+
+
+def aggregate_columns(table, options=DEFAULT_AGGREGATE_OPTIONS):
+    """
+    Collect request times by URL from exported request records. Times are grouped by URL
+    dictionary index, so URLs are normalized once per distinct value instead of per line
+
+    Args:
+        table (columns.ColumnTable): Request records
+        options (AggregateOptions): Aggregation options
+
+    Returns:
+        tuple: Lines count, broken lines count and request times by URL
+    """
+    urls = table.dictionaries['url']
+    if options.normalize_url:
+        urls = [options.normalize_url(url) for url in urls]
+    url_stats = [options.stats_factory() for _ in urls]
+    for index, request_time in zip(table.columns['url'], table.columns['request_time']):
+        url_stats[index].append(request_time)
+
+    requests = defaultdict(options.stats_factory)
+    for url, stats in zip(urls, url_stats):
+        if url in requests:
+            requests[url].extend(stats)
+        else:
+            requests[url] = stats
+    return table.meta['lines'], table.meta['fails'], requests
+
+
+def extract_info_from_columns(log_file, export_dir, error_percent, aggregate='list',
+                              sketch_accuracy=0.01, gzip_reader='gzip', url_normalizer=None,
+                              url_limit=0):
+    """
+    Extract information about requests from exported records of log file (log is parsed
+    and exported on first call only)
+
+    Args:
+        log_file (LogFile): Log file
+        export_dir (pathlib.Path): Export directory path
+        error_percent (float): Error max percent
+        aggregate (str): Aggregate mode (see `extract_info_from_file`)
+        sketch_accuracy (float): Relative accuracy of median in `sketch` mode
+        gzip_reader (str): Gzip reader (see `open_log_file`)
+        url_normalizer (callable): URL normalization function (see `create_url_normalizer`)
+        url_limit (int): Maximum number of distinct URLs, others are folded into `other` URL
+            (0 - unlimited)
+
+    Returns:
+        dict: Request data
+
+    Raises:
+        ValueError: If log errors limit was exceeded
+    """
+    table = load_exported_log(log_file, get_columns_path(export_dir, log_file.date),
+                              gzip_reader)
+    check_error_limit(table.meta['lines'], table.meta['fails'], error_percent)
+
+    options = AggregateOptions(get_stats_factory(aggregate, sketch_accuracy), url_normalizer,
+                               url_limit)
+    _, _, requests = aggregate_columns(table, options)
+    if url_limit:
+        fold_rare_urls(requests, url_limit)
+    return requests
+
+
+def check_error_limit(lines, fails, error_percent):
+    """
+    Check percentage of broken lines
+
+    Args:
+        lines (int): Lines count
+        fails (int): Broken lines count
+        error_percent (float): Error max percent
+
+    Raises:
+        ValueError: If log errors limit was exceeded
+    """
+    errors = 100 * fails / lines if lines else 0
+    if errors > error_percent:
+        raise ValueError('Log errors limit was exceeded. Error percent {}% more than {}%'.format(
+            errors, error_percent
+        ))
+
+
+def get_error_lower_bound(lines, fails, z=ERROR_CONFIDENCE_Z):
+    """
+    Get lower bound of Wilson score interval of errors rate
+
+    Args:
+        lines (int): Lines count
+        fails (int): Broken lines count
+        z (float): Z-score of confidence level
+
+    Returns:
+        float: Errors rate lower bound in percents
+    """
+    if not lines:
+        return 0.0
+    rate = fails / lines
+    z2 = z * z
+    center = rate + z2 / (2 * lines)
+    spread = z * (rate * (1 - rate) / lines + z2 / (4 * lines * lines)) ** 0.5
+    return 100 * (center - spread) / (1 + z2 / lines)
+
+
+def check_error_estimate(lines, fails, error_percent):
+    """
+    Check percentage of broken lines in part of log, assuming that errors are distributed
+    evenly over the log
+
+    Args:
+        lines (int): Lines count
+        fails (int): Broken lines count
+        error_percent (float): Error max percent
+
+    Raises:
+        ValueError: If log errors limit is exceeded with high confidence
+    """
+    lower_bound = get_error_lower_bound(lines, fails)
+    if lower_bound > error_percent:
+        raise ValueError('Log errors limit is exceeded. Error percent is at least {:.2f}% '
+                         '({} of {} lines checked) more than {}%'.format(
+                             lower_bound, fails, lines, error_percent
+                         ))
+
+
+def sample_log_lines(log_file, size):
+    """
+    Read lines from the beginning of log file and (for uncompressed log) lines from
+    `ERROR_SAMPLE_CHUNKS` random offsets
+
+    Args:
+        log_file (LogFile): Log file
+        size (int): Number of lines read from the beginning and from random offsets
+
+    Returns:
+        bytes: Log file line
+    """
+    with open_log_file(log_file) as f:
+        yield from islice(chain.from_iterable(read_blocks(f)), size)
+    if log_file.ext == '.gz':
+        return
+
+    path = str(log_file.path)
+    file_size = log_file.path.stat().st_size
+    chunk_size = max(size // ERROR_SAMPLE_CHUNKS, 1)
+    rnd = random.Random(file_size)
+    offsets = sorted(rnd.randrange(file_size) for _ in range(ERROR_SAMPLE_CHUNKS)) \
+        if file_size else []
+    with open(path, 'rb') as f:
+        for offset in offsets:
+            f.seek(offset)
+            f.readline()
+            yield from islice(chain.from_iterable(read_mapped_blocks(path, f.tell())),
+                              chunk_size)
+
+
+def check_error_sample(log_file, error_percent, size=ERROR_CHECK_LINES):
+    """
+    Check percentage of broken lines in log file sample
+
+    Args:
+        log_file (LogFile): Log file
+        error_percent (float): Error max percent
+        size (int): Number of sampled lines (see `sample_log_lines`)
+
+    Raises:
+        ValueError: If log errors limit is exceeded with high confidence
+    """
+    lines = 0
+    fails = 0
+    for line in sample_log_lines(log_file, size):
+        lines += 1
+        if not parse_line_bytes(line):
+            fails += 1
+    check_error_estimate(lines, fails, error_percent)
+
+
+def get_log_signature(log_file):
+    """
+    Get log file signature used to detect changes since last parsing
+
+    Args:
+        log_file (LogFile): Log file
+
+    Returns:
+        tuple: File size and modification time
+    """
+    stat = log_file.path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def update_state(log_file, state, error_percent, workers=1, aggregate='list',
+                 sketch_accuracy=0.01, gzip_reader='gzip', url_normalizer=None, url_limit=0):
+    """
+    Parse log file lines added since saved state and merge them into state
+
+    Only complete lines are parsed, so partially written last line is parsed on next update.
+    State is rebuilt from scratch if it belongs to another file, was built in another aggregate
+    mode or log file was truncated.
+
+    Args:
+        log_file (LogFile): Log file
+        state (LogState): Saved state (None to parse whole file)
+        error_percent (float): Error max percent
+        workers (int): Number of parsing processes (uncompressed logs only)
+        aggregate (str): Aggregate mode (see `extract_info_from_file`)
+        sketch_accuracy (float): Relative accuracy of median in `sketch` mode
+        gzip_reader (str): Gzip reader (see `open_log_file`)
+        url_normalizer (callable): URL normalization function (see `create_url_normalizer`)
+        url_limit (int): Maximum number of distinct URLs (0 - unlimited)
+
+    Returns:
+        LogState: Updated state
+
+    Raises:
+        ValueError: If log errors limit was exceeded
+    """
+    signature = get_log_signature(log_file)
+    if state and (state.path != str(log_file.path) or state.aggregate != aggregate
+                  or signature[0] < state.signature[0]):
+        logging.info('Saved state of "{}" is outdated, parsing from scratch'.format(
+            log_file.path
+        ))
+        state = None
+
+    offset = state.offset if state else 0
+    options = AggregateOptions(get_stats_factory(aggregate, sketch_accuracy), url_normalizer,
+                               url_limit)
+    if log_file.ext != '.gz':
+        path = str(log_file.path)
+        end = get_complete_size(path)
+        ranges = get_log_ranges(log_file, workers, offset, end)
+        if workers > 1:
+            results = aggregate_log_ranges(path, ranges, workers, options)
+        else:
+            results = merge_requests(aggregate_log_range(path, start, end, options)
+                                     for start, end in ranges)
+    else:
+        end, *results = aggregate_log_stream(log_file, offset, options, gzip_reader)
+
+    if state:
+        results = merge_requests([(state.lines, state.fails, state.requests), results])
+    lines, fails, requests = results
+    check_error_limit(lines, fails, error_percent)
+    if url_limit:
+        fold_rare_urls(requests, url_limit)
+    return LogState(str(log_file.path), log_file.date, signature, end, lines, fails, aggregate,
+                    requests)
+
+
+def get_state_path(report_path):
+    """
+    Get path of aggregate state saved alongside report
+
+    Args:
+        report_path (pathlib.Path): Report file path
+
+    Returns:
+        pathlib.Path: State file path
+    """
+    return report_path.with_suffix('.state')
+
+
+def save_state(state, state_path):
+    """
+    Save aggregate state to binary file (atomically, via temporary file)
+
+    Args:
+        state (LogState): Aggregate state
+        state_path (pathlib.Path): State file path
+    """
+    tmp_path = state_path.with_name(state_path.name + '.tmp')
+    with open(str(tmp_path), 'wb') as f:
+        pickle.dump((STATE_VERSION, state._asdict()), f, pickle.HIGHEST_PROTOCOL)
+    os.replace(str(tmp_path), str(state_path))
+
+
+def load_state(state_path):
+    """
+    Load aggregate state from binary file
+
+    Args:
+        state_path (pathlib.Path): State file path
+
+    Returns:
+        LogState: Aggregate state or None if state has unsupported version
+    """
+    with open(str(state_path), 'rb') as f:
+        version, fields = pickle.load(f)
+    if version != STATE_VERSION:
+        return None
+    return LogState(**fields)
+
+
+def merge_states(states):
+    """
+    Merge aggregate states of several logs
+
+    Args:
+        states (list): Aggregate states
+
+    Returns:
+        tuple: Lines count, broken lines count and request times by URL
+
+    Raises:
+        ValueError: If states were built in different aggregate modes
+    """
+    if len({state.aggregate for state in states}) > 1:
+        raise ValueError('States with different aggregate modes can not be merged')
+    return merge_requests((state.lines, state.fails, state.requests) for state in states)
+
+
+def prepare_report_data(requests, report_size, percentiles=()):
+    """
+    Process request statistics and generate report data
+
+    Top `report_size` URLs by total time are selected with heap, so medians and percentages
+    are computed only for URLs included in report. Every percentile `p` is added as
+    `time_p<p>` column (exact for list and `exact` aggregate modes, approximate for `sketch`).
+
+    Args:
+        requests (dict): Request times by URL (list, `ExactStats` or `SketchStats`)
+        report_size (int): Maximum report size
+        percentiles (list): Percentiles in range [0, 100]
+
+    Returns:
+        List: Report data
+    """
+    summaries = {url: get_summary(request_times) for url, request_times in requests.items()}
+    total_count = 0
+    total_time = 0.0
+    for request_count, request_time, _ in summaries.values():
+        total_count += request_count
+        total_time += request_time
+
+    top_urls = heapq.nlargest(report_size, summaries, key=lambda url: round(summaries[url][1], 3))
+    report_data = []
+    for url in top_urls:
+        request_count, request_time, request_max = summaries[url]
+        request_times = requests[url]
+        row = {
+            'url': url,
+            'count': request_count,
+            'count_perc': round(100.0 * request_count / float(total_count), 3),
+            'time_sum': round(request_time, 3),
+            'time_perc': round(100.0 * request_time / total_time, 3),
+            'time_avg': round(request_time / request_count, 3),
+            'time_max': round(request_max, 3),
+            'time_med': round(get_median(request_times), 3),
+        }
+        if percentiles:
+            values = get_percentiles(request_times, percentiles)
+            for percentile, value in zip(percentiles, values):
+                row['time_p{:g}'.format(percentile)] = round(value, 3)
+        report_data.append(row)
+    return report_data
+
+
+def create_report(report_data, report_dir, log_date):
+    """
+    Save report data to HTML file
+
+    Args:
+        report_data (list): Report data
+        report_dir (pathlib.Path): Report directory path
+        log_date (datetime.date): Log file data
+
+    Returns:
+        pathlib.Path: Report file path
+    """
+    report_date = log_date.strftime('%Y.%m.%d')
+    report_path = report_dir.joinpath('report-{}.html'.format(report_date))
+    write_report(report_data, report_path)
+    return report_path
+
+
+def write_report(report_data, report_path):
+    """
+    Save report data to HTML file with given path
+
+    Report rows are streamed into temporary file which then replaces report file, so report
+    is never partially written.
+
+    Args:
+        report_data (list): Report data
+        report_path (pathlib.Path): Report file path
+    """
+    head, tail = load_report_template(REPORT_TEMPLATE_PATH)
+    tmp_path = report_path.with_name(report_path.name + '.tmp')
+    try:
+        with open(str(tmp_path), 'w', encoding='utf-8') as f:
+            f.write(head)
+            f.write('[')
+            for i, row in enumerate(report_data):
+                if i:
+                    f.write(', ')
+                f.write(json.dumps(row))
+            f.write(']')
+            f.write(tail)
+        os.replace(str(tmp_path), str(report_path))
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+@lru_cache()
+def load_report_template(template_path):
+    """
+    Load report template and split it at table data marker
+
+    Args:
+        template_path (str): Template file path
+
+    Returns:
+        tuple: Template parts before and after table data marker
+
+    Raises:
+        ValueError: If template does not contain table data marker
+    """
+    with open(template_path, 'r', encoding='utf-8') as f:
+        template = f.read()
+    head, marker, tail = template.partition(REPORT_TABLE_MARKER)
+    if not marker:
+        raise ValueError('Report template does not contain "{}"'.format(REPORT_TABLE_MARKER))
+    return head, tail
+
+
+def create_rollup_report(report_dir, date_from, date_to, report_size, percentiles=()):
+    """
+    Create report for date range by merging aggregate states saved alongside daily reports
+
+    Args:
+        report_dir (pathlib.Path): Report directory path
+        date_from (datetime.date): First date of range
+        date_to (datetime.date): Last date of range
+        report_size (int): Maximum report size
+        percentiles (list): Percentiles added to report
+
+    Returns:
+        pathlib.Path: Report file path or None if there are no saved states for date range
+    """
+    states = []
+    for day in range((date_to - date_from).days + 1):
+        log_date = date_from + timedelta(days=day)
+        report_path = report_dir.joinpath('report-{}.html'.format(log_date.strftime('%Y.%m.%d')))
+        state_path = get_state_path(report_path)
+        state = load_state(state_path) if state_path.exists() else None
+        if state:
+            states.append(state)
+    if not states:
+        return None
+
+    _, _, requests = merge_states(states)
+    report_data = prepare_report_data(requests, report_size, percentiles)
+    report_path = get_range_report_path(report_dir, date_from, date_to)
+    write_report(report_data, report_path)
+    return report_path
+
+
+def get_range_report_path(report_dir, date_from, date_to):
+    """
+    Generate path of report for date range
+
+    Args:
+        report_dir (pathlib.Path): Report directory path
+        date_from (datetime.date): First date of range
+        date_to (datetime.date): Last date of range
+
+    Returns:
+        pathlib.Path: Report file path
+    """
+    return report_dir.joinpath('report-{}-{}.html'.format(
+        date_from.strftime('%Y.%m.%d'), date_to.strftime('%Y.%m.%d')
+    ))
+
+
+def analyze_log_file(log_file, config, state=None, workers=1):
+    """
+    Extract information about requests from log file (also used as process pool worker)
+
+    Args:
+        log_file (LogFile): Log file
+        config (dict): Program configuration
+        state (LogState): Saved state to update (if `SAVE_STATE` is enabled)
+        workers (int): Number of parsing processes
+
+    Returns:
+        LogState|dict: Aggregate state if `SAVE_STATE` is enabled, else request data
+    """
+    url_normalizer = create_url_normalizer(config.get('URL_STRIP_QUERY'),
+                                           config.get('URL_COLLAPSE_IDS'),
+                                           config.get('URL_RULES'))
+    if config.get('SAVE_STATE'):
+        return update_state(log_file, state, config.get('ERROR_PERCENT'), workers,
+                            config.get('AGGREGATE'), config.get('SKETCH_ACCURACY'),
+                            config.get('GZIP_READER'), url_normalizer, config.get('URL_LIMIT'))
+    if config.get('EXPORT_DIR'):
+        return extract_info_from_columns(log_file, pathlib.Path(config.get('EXPORT_DIR')),
+                                         config.get('ERROR_PERCENT'), config.get('AGGREGATE'),
+                                         config.get('SKETCH_ACCURACY'),
+                                         config.get('GZIP_READER'), url_normalizer,
+                                         config.get('URL_LIMIT'))
+    return extract_info_from_file(log_file, config.get('ERROR_PERCENT'), workers,
+                                  config.get('AGGREGATE'), config.get('SKETCH_ACCURACY'),
+                                  config.get('GZIP_READER'), url_normalizer,
+                                  config.get('URL_LIMIT'), config.get('ERROR_CHECK_LINES'))
+
+
+def process_log_files(log_files, report_dir, config):
+    """
+    Create reports for log files which were not processed yet (parsing files concurrently)
+    and combined report for all of them
+
+    Log files exceeding errors limit or failed to be parsed (e.g. truncated gzip files) are
+    skipped. Combined report also includes days which already had reports if their aggregate
+    states were saved in the same aggregate mode.
+
+    Args:
+        log_files (list): Log files sorted by date
+        report_dir (pathlib.Path): Report directory path
+        config (dict): Program configuration
+
+    Returns:
+        list: Created reports paths (combined report is the last one)
+    """
+    results = []
+    pending = []
+    for log_file in log_files:
+        report_path = get_report_path(log_file, report_dir)
+        state_path = get_state_path(report_path)
+        if not report_path.exists():
+            pending.append(log_file)
+        elif state_path.exists():
+            state = load_state(state_path)
+            if state and state.aggregate == config.get('AGGREGATE'):
+                results.append((log_file, state))
+
+    report_paths = []
+    with ProcessPoolExecutor(max_workers=config.get('WORKERS')) as executor:
+        futures = [(log_file, executor.submit(analyze_log_file, log_file, config))
+                   for log_file in pending]
+        for log_file, future in futures:
+            try:
+                result = future.result()
+            except ValueError as e:
+                logging.error('Log file "{}" was skipped: {}'.format(log_file.path, e))
+                continue
+            except Exception:
+                logging.exception('Log file "{}" was skipped'.format(log_file.path))
+                continue
+
+            requests = result.requests if config.get('SAVE_STATE') else result
+            report_data = prepare_report_data(requests, config.get('REPORT_SIZE'),
+                                              config.get('PERCENTILES'))
+            report_paths.append(create_report(report_data, report_dir, log_file.date))
+            if config.get('SAVE_STATE'):
+                save_state(result, get_state_path(report_paths[-1]))
+            results.append((log_file, result))
+            logging.info('Report "{}" from file "{}" was created successfully'.format(
+                report_paths[-1], log_file.path
+            ))
+
+    if not report_paths:
+        return report_paths
+
+    # Report data of the same file is not used anymore, so per-URL containers can be merged
+    results.sort(key=lambda result: result[0].date)
+    _, _, requests = merge_requests(
+        (0, 0, result.requests if isinstance(result, LogState) else result)
+        for _, result in results
+    )
+    report_data = prepare_report_data(requests, config.get('REPORT_SIZE'),
+                                      config.get('PERCENTILES'))
+    report_path = get_range_report_path(report_dir, results[0][0].date, results[-1][0].date)
+    write_report(report_data, report_path)
+    report_paths.append(report_path)
+    logging.info('Combined report "{}" was created successfully'.format(report_path))
+    return report_paths
+
+
+class LogFollower:
+    """
+    Reader of complete lines appended to live log file. File is reopened when it is replaced
+    (rotated) and reread from the beginning when it is truncated
+    """
+    def __init__(self, path, read_size=FOLLOW_READ_SIZE):
+        """
+        Args:
+            path (pathlib.Path): Live log file path
+            read_size (int): Maximum number of bytes read at once
+        """
+        self.path = path
+        self.read_size = read_size
+        self.f = None
+        self.inode = None
+        self.tail = b''
+
+    def _open(self):
+        """
+        Open live log file (if it exists)
+
+        Returns:
+            bool: Whether file was opened
+        """
+        try:
+            self.f = open(str(self.path), 'rb')
+        except FileNotFoundError:
+            return False
+        self.inode = os.fstat(self.f.fileno()).st_ino
+        self.tail = b''
+        return True
+
+    def poll(self):
+        """
+        Read new complete lines
+
+        Returns:
+            tuple: New lines without line separators and flag whether log was rotated
+                or truncated (lines belong to new log then). Opening of the log for the
+                first time is not reported as rotation
+        """
+        if self.f is None:
+            rotated = self.inode is not None
+            return [], self._open() and rotated
+
+        data = self.f.read(self.read_size)
+        if data:
+            lines = (self.tail + data).split(b'\n')
+            self.tail = lines.pop()
+            return lines, False
+
+        # All data was read, check whether file was rotated or truncated
+        try:
+            stat = os.stat(str(self.path))
+        except FileNotFoundError:
+            return [], False
+        if stat.st_ino != self.inode:
+            self.close()
+            return [], self._open()
+        if stat.st_size < self.f.tell():
+            self.f.seek(0)
+            self.tail = b''
+            return [], True
+        return [], False
+
+    def close(self):
+        """Close live log file"""
+        if self.f:
+            self.f.close()
+            self.f = None
+
+
+def follow_log(log_path, report_path, config, stop=lambda: False, sleep=time.sleep):
+    """
+    Tail live log file, update aggregates incrementally and rewrite report periodically.
+    Aggregates are reset when log is rotated
+
+    Args:
+        log_path (pathlib.Path): Live log file path
+        report_path (pathlib.Path): Report file path
+        config (dict): Program configuration
+        stop (callable): Function returning True when following should be stopped
+        sleep (callable): Function used to wait for new lines
+
+    Returns:
+        tuple: Lines count, broken lines count and request times by URL since last rotation
+    """
+    options = AggregateOptions(
+        get_stats_factory(config.get('AGGREGATE'), config.get('SKETCH_ACCURACY')),
+        create_url_normalizer(config.get('URL_STRIP_QUERY'), config.get('URL_COLLAPSE_IDS'),
+                              config.get('URL_RULES')),
+        config.get('URL_LIMIT'),
+    )
+    follower = LogFollower(log_path)
+    results = (0, 0, defaultdict(options.stats_factory))
+    updated = False
+    next_report = time.monotonic() + config.get('FOLLOW_INTERVAL')
+    try:
+        while not stop():
+            lines, reset = follower.poll()
+            if reset:
+                logging.info('Log "{}" was rotated'.format(log_path))
+                results = (0, 0, defaultdict(options.stats_factory))
+            if lines:
+                parsed_lines = [parse_line_bytes(line) for line in lines]
+                results = merge_requests([results, aggregate_requests(parsed_lines, options)])
+                updated = True
+
+            if updated and time.monotonic() >= next_report:
+                write_live_report(results, report_path, config)
+                updated = False
+                next_report = time.monotonic() + config.get('FOLLOW_INTERVAL')
+            if not lines:
+                sleep(FOLLOW_POLL_INTERVAL)
+    finally:
+        follower.close()
+    if updated:
+        write_live_report(results, report_path, config)
+    return results
+
+
+def write_live_report(results, report_path, config):
+    """
+    Rewrite report of live log
+
+    Args:
+        results (tuple): Lines count, broken lines count and request times by URL
+        report_path (pathlib.Path): Report file path
+        config (dict): Program configuration
+    """
+    lines, fails, requests = results
+    if config.get('URL_LIMIT'):
+        fold_rare_urls(requests, config.get('URL_LIMIT'))
+    report_data = prepare_report_data(requests, config.get('REPORT_SIZE'),
+                                      config.get('PERCENTILES'))
+    write_report(report_data, report_path)
+    logging.info('Report "{}" was updated: {} lines, {:.2f}% errors'.format(
+        report_path, lines, 100 * fails / lines if lines else 0
+    ))
+
+
+def main():
+    config = load_config()
+    setup_logger(config.get('LOG_FILE'))
+
+    log_dir = pathlib.Path(config.get('LOG_DIR'))
+    if config.get('FOLLOW'):
+        report_path = pathlib.Path(config.get('REPORT_DIR')).joinpath(config.get('FOLLOW_REPORT'))
+        try:
+            follow_log(log_dir.joinpath(config.get('FOLLOW_LOG')), report_path, config)
+        except KeyboardInterrupt:
+            logging.info('Following was stopped')
+        return
+
+    if config.get('BACKFILL') or config.get('DATE_FROM') or config.get('DATE_TO'):
+        date_from, date_to = [
+            datetime.strptime(config.get(key), '%Y.%m.%d').date() if config.get(key) else None
+            for key in ('DATE_FROM', 'DATE_TO')
+        ]
+        log_files = get_log_files(log_dir, date_from, date_to)
+        if not process_log_files(log_files, pathlib.Path(config.get('REPORT_DIR')), config):
+            logging.info('No unprocessed logs in "{}"'.format(log_dir))
+        return
+
+    # 1. Get log file instance
+    log_file = get_latest_log_file(log_dir)
+    if not log_file:
+        logging.info('No logs in "{}"'.format(log_file))
+        return
+
+    # 2. Get report file path
+    report_dir = pathlib.Path(config.get('REPORT_DIR'))
+    report_path = get_report_path(log_file, report_dir)
+    state_path = get_state_path(report_path)
+    state = None
+    if report_path.exists():
+        if config.get('SAVE_STATE') and state_path.exists():
+            state = load_state(state_path)
+        if not state or state.signature == get_log_signature(log_file):
+            logging.info('Report for "{}" already exists'.format(log_file.date))
+            return
+
+    # 3. Extract logs and create report
+    result = analyze_log_file(log_file, config, state, config.get('WORKERS'))
+    if config.get('SAVE_STATE'):
+        state = result
+        requests = state.requests
+    else:
+        requests = result
+    report_data = prepare_report_data(requests, config.get('REPORT_SIZE'),
+                                      config.get('PERCENTILES'))
+    report_path = create_report(report_data, report_dir, log_file.date)
+    if config.get('SAVE_STATE'):
+        save_state(state, state_path)
+
+    logging.info('Report "{}" from file "{}" was created successfully'.format(
+        report_path, log_file.path
+    ))
+
+    # 4. Create report for last days from saved states
+    if config.get('ROLLUP_DAYS'):
+        date_from = log_file.date - timedelta(days=config.get('ROLLUP_DAYS') - 1)
+        rollup_path = create_rollup_report(report_dir, date_from, log_file.date,
+                                           config.get('REPORT_SIZE'), config.get('PERCENTILES'))
+        if rollup_path:
+            logging.info('Rollup report "{}" was created successfully'.format(rollup_path))
 
 
 if __name__ == '__main__':
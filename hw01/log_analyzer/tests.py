@@ -1,11 +1,25 @@
 from datetime import date
+import gzip
+import json
+import math
 import pathlib
+import shutil
 import sys
+import tempfile
 import unittest
+from unittest import mock
 
+import aggregates as ag
+import benchmark
+import columns
 import log_analyzer as la
 
 
+def get_summaries(requests):
+    """Get count, sum and max of request times by URL"""
+    return {url: ag.get_summary(request_times) for url, request_times in requests.items()}
+
+
 class GetConfigPathTestCase(unittest.TestCase):
     def test_default_path(self):
         path = la.get_config_path()
@@ -28,6 +42,26 @@ class LoadConfigTestCase(unittest.TestCase):
             'LOG_DIR': './log',
             'LOG_FILE': None,
             'ERROR_PERCENT': 10,
+            'ERROR_CHECK_LINES': 10000,
+            'WORKERS': 1,
+            'AGGREGATE': 'list',
+            'SKETCH_ACCURACY': 0.01,
+            'GZIP_READER': 'gzip',
+            'SAVE_STATE': False,
+            'ROLLUP_DAYS': 0,
+            'BACKFILL': False,
+            'DATE_FROM': None,
+            'DATE_TO': None,
+            'URL_STRIP_QUERY': False,
+            'URL_COLLAPSE_IDS': False,
+            'URL_RULES': [],
+            'URL_LIMIT': 0,
+            'PERCENTILES': [],
+            'FOLLOW': False,
+            'FOLLOW_LOG': 'nginx-access-ui.log',
+            'FOLLOW_REPORT': 'report-live.html',
+            'FOLLOW_INTERVAL': 60,
+            'EXPORT_DIR': None,
         })
 
     def test_no_file(self):
@@ -67,6 +101,93 @@ class GetLatestLogFileTestCase(unittest.TestCase):
         self.assertRaises(FileNotFoundError, la.get_latest_log_file, log_dir)
 
 
+class GetLogFilesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = pathlib.Path(tempfile.mkdtemp())
+        for name in ('nginx-access-ui.log-20190101', 'nginx-access-ui.log-20190103.gz',
+                     'nginx-access-ui.log-20190102', 'nginx-access-ui.log-20191332',
+                     'nginx-access-ui.log-20190104.bz2', 'other.log-20190105'):
+            self.log_dir.joinpath(name).touch()
+
+    def tearDown(self):
+        shutil.rmtree(str(self.log_dir))
+
+    def test_all(self):
+        log_files = la.get_log_files(self.log_dir)
+        self.assertEqual(log_files, [
+            la.LogFile(self.log_dir.joinpath('nginx-access-ui.log-20190101'),
+                       date(2019, 1, 1), ''),
+            la.LogFile(self.log_dir.joinpath('nginx-access-ui.log-20190102'),
+                       date(2019, 1, 2), ''),
+            la.LogFile(self.log_dir.joinpath('nginx-access-ui.log-20190103.gz'),
+                       date(2019, 1, 3), '.gz'),
+        ])
+
+    def test_range(self):
+        log_files = la.get_log_files(self.log_dir, date(2019, 1, 2), date(2019, 1, 2))
+        self.assertEqual([log_file.date for log_file in log_files], [date(2019, 1, 2)])
+        log_files = la.get_log_files(self.log_dir, date_from=date(2019, 1, 2))
+        self.assertEqual(len(log_files), 2)
+        log_files = la.get_log_files(self.log_dir, date_to=date(2019, 1, 2))
+        self.assertEqual(len(log_files), 2)
+
+    def test_no_log_dir(self):
+        self.assertRaises(FileNotFoundError, la.get_log_files, pathlib.Path('no_dir'))
+
+
+class ProcessLogFilesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = pathlib.Path(tempfile.mkdtemp())
+        with open('log/test_log', 'rb') as f:
+            data = f.read() + b'\n'
+        self.tmp_dir.joinpath('nginx-access-ui.log-20190101').write_bytes(data)
+        self.tmp_dir.joinpath('nginx-access-ui.log-20190102.gz').write_bytes(gzip.compress(data))
+        shutil.copy('log/test_log_error',
+                    str(self.tmp_dir.joinpath('nginx-access-ui.log-20190103')))
+        self.config = dict(la.DEFAULT_CONFIG, WORKERS=2)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def test_ok(self):
+        log_files = la.get_log_files(self.tmp_dir)
+        with self.assertLogs(level='ERROR'):
+            report_paths = la.process_log_files(log_files, self.tmp_dir, self.config)
+        self.assertEqual([path.name for path in report_paths], [
+            'report-2019.01.01.html',
+            'report-2019.01.02.html',
+            'report-2019.01.01-2019.01.02.html',
+        ])
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(la.process_log_files(log_files, self.tmp_dir, self.config), [])
+
+    def test_saved_states(self):
+        config = dict(self.config, SAVE_STATE=True)
+        log_files = la.get_log_files(self.tmp_dir, date_to=date(2019, 1, 1))
+        la.process_log_files(log_files, self.tmp_dir, config)
+
+        log_files = la.get_log_files(self.tmp_dir, date_to=date(2019, 1, 2))
+        report_paths = la.process_log_files(log_files, self.tmp_dir, config)
+        self.assertEqual([path.name for path in report_paths], [
+            'report-2019.01.02.html',
+            'report-2019.01.01-2019.01.02.html',
+        ])
+        self.assertTrue(self.tmp_dir.joinpath('report-2019.01.02.state').exists())
+
+    def test_corrupt_gzip(self):
+        data = self.tmp_dir.joinpath('nginx-access-ui.log-20190102.gz').read_bytes()
+        self.tmp_dir.joinpath('nginx-access-ui.log-20181231.gz').write_bytes(data[:-20])
+        log_files = la.get_log_files(self.tmp_dir)
+        with self.assertLogs(level='ERROR') as logs:
+            report_paths = la.process_log_files(log_files, self.tmp_dir, self.config)
+        self.assertTrue(any('nginx-access-ui.log-20181231.gz' in line for line in logs.output))
+        self.assertEqual([path.name for path in report_paths], [
+            'report-2019.01.01.html',
+            'report-2019.01.02.html',
+            'report-2019.01.01-2019.01.02.html',
+        ])
+
+
 class GetReportPathTestCase(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -100,6 +221,164 @@ class ParseLineTestCase(unittest.TestCase):
         request = la.parse_line(line)
         self.assertIsNone(request)
 
+    def test_tokenizer_matches_regex(self):
+        with open('log/test_log', encoding='utf-8') as f:
+            for line in f:
+                self.assertEqual(la.tokenize_line(line), la.parse_line_regex(line))
+
+    def test_regex_fallback(self):
+        line = '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] ' \
+               '"GET /api/v2/banner/25019354 HTTP/1.1" 200 927 "-" ' \
+               '"Lynx/2.8.8dev.9 "quoted" agent" "-" ' \
+               '"1498697422-2190034393-4708-9752759" "dc7161be3" 0.390'
+        self.assertIsNone(la.tokenize_line(line))
+        request = la.parse_line(line)
+        self.assertEqual(request, la.LogLine('GET /api/v2/banner/25019354 HTTP/1.1', 0.390))
+
+
+    def test_malformed_fields(self):
+        lines = (
+            'garbage "GET / HTTP/1.1" x "a" "b" "c" "d" "e" 0.5',
+            '1.196.116.32 -  - 29/Jun/2017 "GET / HTTP/1.1" 200 927 "-" "-" "-" "-" "-" 0.5',
+            '1.196.116.32 -  - [29/Jun/2017] "GET / HTTP/1.1" OK 927 "-" "-" "-" "-" "-" 0.5',
+            '1.196.116.32 -  - [29/Jun/2017] "GET / HTTP/1.1" 200 927 "-""-" "-" "-" "-" 0.5',
+        )
+        for line in lines:
+            self.assertIsNone(la.tokenize_line(line))
+            self.assertEqual(la.parse_line(line), la.parse_line_regex(line))
+            self.assertIsNone(la.tokenize_line_bytes(line.encode('utf-8')))
+            self.assertEqual(la.parse_line_bytes(line.encode('utf-8')), la.parse_line(line))
+
+
+class ParseLineBytesTestCase(unittest.TestCase):
+    def test_matches_text_parser(self):
+        with open('log/test_log_error', encoding='utf-8') as f:
+            for line in f:
+                self.assertEqual(la.parse_line_bytes(line.encode('utf-8')), la.parse_line(line))
+
+    def test_regex_fallback(self):
+        line = b'1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] ' \
+               b'"GET /api/v2/banner/25019354 HTTP/1.1" 200 927 "-" ' \
+               b'"Lynx/2.8.8dev.9 "quoted" agent" "-" ' \
+               b'"1498697422-2190034393-4708-9752759" "dc7161be3" 0.390'
+        self.assertIsNone(la.tokenize_line_bytes(line))
+        request = la.parse_line_bytes(line)
+        self.assertEqual(request, la.LogLine('GET /api/v2/banner/25019354 HTTP/1.1', 0.390))
+
+    def test_bad_encoding(self):
+        line = b'1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] ' \
+               b'"GET /api/\xff HTTP/1.1" 200 927 "-" "-" "-" "-" "-" 0.390'
+        self.assertIsNone(la.parse_line_bytes(line))
+
+
+class UrlNormalizerTestCase(unittest.TestCase):
+    def test_no_rules(self):
+        self.assertIsNone(la.create_url_normalizer())
+
+    def test_strip_query(self):
+        normalize_url = la.create_url_normalizer(strip_query=True)
+        self.assertEqual(normalize_url('GET /api/1/list/?server_name=WIN7RB4 HTTP/1.1'),
+                         'GET /api/1/list/ HTTP/1.1')
+
+    def test_collapse_ids(self):
+        normalize_url = la.create_url_normalizer(collapse_ids=True)
+        self.assertEqual(normalize_url('GET /api/v2/banner/25019354 HTTP/1.1'),
+                         'GET /api/v2/banner/{id} HTTP/1.1')
+        self.assertEqual(normalize_url('GET /api/v2/internal/banner/24294027/info HTTP/1.1'),
+                         'GET /api/v2/internal/banner/{id}/info HTTP/1.1')
+        self.assertEqual(
+            normalize_url('POST /user/123e4567-e89b-12d3-a456-426655440000/ HTTP/1.1'),
+            'POST /user/{uuid}/ HTTP/1.1'
+        )
+        self.assertEqual(normalize_url('GET /api/v2/slot4705/ HTTP/1.1'),
+                         'GET /api/v2/slot4705/ HTTP/1.1')
+        self.assertEqual(normalize_url('GET /list/?id=1 HTTP/1.1'), 'GET /list/?id=1 HTTP/1.1')
+        self.assertEqual(normalize_url('0'), '0')
+
+    def test_rules(self):
+        normalize_url = la.create_url_normalizer(rules=[[r'^/export/.*$', '/export/*']])
+        self.assertEqual(normalize_url('GET /export/2019/file.csv HTTP/1.1'),
+                         'GET /export/* HTTP/1.1')
+
+
+class FoldRareUrlsTestCase(unittest.TestCase):
+    def test_ok(self):
+        requests = {'url1': [0.1] * 3, 'url2': [0.2], 'url3': [0.3] * 2, 'url4': [0.4]}
+        la.fold_rare_urls(requests, 2)
+        self.assertEqual(requests, {'url1': [0.1] * 3, 'url3': [0.3] * 2, 'other': [0.2, 0.4]})
+
+        requests['url5'] = [0.5]
+        la.fold_rare_urls(requests, 2)
+        self.assertEqual(requests, {'url1': [0.1] * 3, 'url3': [0.3] * 2,
+                                    'other': [0.2, 0.4, 0.5]})
+
+    def test_limit_not_exceeded(self):
+        requests = {'url1': [0.1], 'other': [0.2]}
+        la.fold_rare_urls(requests, 1)
+        self.assertEqual(requests, {'url1': [0.1], 'other': [0.2]})
+
+
+class ReadBlocksTestCase(unittest.TestCase):
+    def test_ok(self):
+        with open('log/test_log_error', 'rb') as f:
+            data = f.read()
+
+        for block_size in (1, 7, 100, 1024 * 1024):
+            with open('log/test_log_error', 'rb') as f:
+                lines = [line for lines in la.read_blocks(f, block_size=block_size)
+                         for line in lines]
+            self.assertEqual(lines, data.splitlines())
+
+    def test_size(self):
+        with open('log/test_log', 'rb') as f:
+            data = f.read()
+        with open('log/test_log', 'rb') as f:
+            f.seek(10)
+            lines = [line for lines in la.read_blocks(f, 100, block_size=7) for line in lines]
+        self.assertEqual(lines, data[10:110].split(b'\n'))
+
+
+class ReadMappedBlocksTestCase(unittest.TestCase):
+    def test_ok(self):
+        for path in ('log/test_log', 'log/test_log_error'):
+            with open(path, 'rb') as f:
+                data = f.read()
+            for block_size in (1, 7, 100, 1024 * 1024):
+                lines = [line for lines in la.read_mapped_blocks(path, block_size=block_size)
+                         for line in lines]
+                self.assertEqual(lines, data.splitlines())
+
+    def test_range(self):
+        with open('log/test_log', 'rb') as f:
+            data = f.read()
+        start = data.index(b'\n') + 1
+        end = data.index(b'\n', start) + 1
+        lines = [line for lines in la.read_mapped_blocks('log/test_log', start, end, 7)
+                 for line in lines]
+        self.assertEqual(lines, [data[start:end - 1]])
+
+    def test_empty(self):
+        with tempfile.NamedTemporaryFile() as f:
+            self.assertEqual(list(la.read_mapped_blocks(f.name)), [])
+
+
+class ThreadedReaderTestCase(unittest.TestCase):
+    def test_ok(self):
+        with open('log/test_log_error', 'rb') as f:
+            data = f.read()
+
+        for block_size in (1, 7, 1024):
+            with la.ThreadedReader(open('log/test_log_error', 'rb'), block_size, 2) as f:
+                self.assertEqual(f.read(10), data[:10])
+                self.assertEqual(f.read(), data[10:])
+                self.assertEqual(f.read(10), b'')
+
+    def test_early_close(self):
+        f = la.ThreadedReader(open('log/test_log_error', 'rb'), 1, 1)
+        f.read(1)
+        f.close()
+        self.assertFalse(f.thread.is_alive())
+
 
 class ExtractInfoFromFileTestCase(unittest.TestCase):
     def test_plain(self):
@@ -126,11 +405,312 @@ class ExtractInfoFromFileTestCase(unittest.TestCase):
             'GET /api/v2/internal/banner/24294027/info HTTP/1.1': [0.146]
         })
 
+    def test_url_normalization(self):
+        log_file = la.LogFile(pathlib.Path('log/test_log'), date(2019, 1, 1), ext='')
+        url_normalizer = la.create_url_normalizer(strip_query=True, collapse_ids=True)
+        for workers in (1, 2):
+            requests = la.extract_info_from_file(log_file, 10, workers,
+                                                 url_normalizer=url_normalizer, url_limit=2)
+            self.assertEqual(requests, {
+                'GET /api/v2/banner/{id} HTTP/1.1': [0.39, 0.199],
+                'GET /api/{id}/photogenic_banners/list/ HTTP/1.1': [0.133],
+                'other': [0.704, 0.146],
+            })
+
+    def test_gzip_readers(self):
+        log_file = la.LogFile(pathlib.Path('log/test_log.gz'), date(2019, 1, 1), ext='.gz')
+        error_percent = 10
+        expected = la.extract_info_from_file(log_file, error_percent)
+        for gzip_reader in ('thread', 'external'):
+            requests = la.extract_info_from_file(log_file, error_percent,
+                                                 gzip_reader=gzip_reader)
+            self.assertEqual(requests, expected)
+        self.assertRaises(ValueError, la.extract_info_from_file, log_file, error_percent,
+                          gzip_reader='unknown')
+
     def test_error_limit(self):
         log_file = la.LogFile(pathlib.Path('log/test_log_error'), date(2019, 1, 1), ext='')
         error_percent = 10
         self.assertRaises(ValueError, la.extract_info_from_file, log_file, error_percent)
 
+    def test_workers(self):
+        log_file = la.LogFile(pathlib.Path('log/test_log'), date(2019, 1, 1), ext='')
+        error_percent = 10
+        expected = la.extract_info_from_file(log_file, error_percent)
+        for workers in (2, 3, 8):
+            requests = la.extract_info_from_file(log_file, error_percent, workers)
+            self.assertEqual(requests, expected)
+            self.assertEqual(list(requests), list(expected))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = benchmark.generate_log(pathlib.Path(tmp_dir).joinpath('log'), 20000, 20)
+            log_file = la.LogFile(path, date(2017, 6, 30), '')
+            for aggregate in ('list', 'exact', 'sketch'):
+                expected = la.extract_info_from_file(log_file, error_percent,
+                                                     aggregate=aggregate)
+                for workers in (2, 3):
+                    requests = la.extract_info_from_file(log_file, error_percent, workers,
+                                                         aggregate)
+                    self.assertEqual(get_summaries(requests), get_summaries(expected))
+                    self.assertEqual(la.prepare_report_data(requests, 20),
+                                     la.prepare_report_data(expected, 20))
+
+    def test_workers_error_limit(self):
+        log_file = la.LogFile(pathlib.Path('log/test_log_error'), date(2019, 1, 1), ext='')
+        error_percent = 10
+        self.assertRaises(ValueError, la.extract_info_from_file, log_file, error_percent, 3)
+
+    def test_aggregate_modes(self):
+        log_file = la.LogFile(pathlib.Path('log/test_log'), date(2019, 1, 1), ext='')
+        error_percent = 10
+        expected = la.prepare_report_data(la.extract_info_from_file(log_file, error_percent), 10)
+        for aggregate in ('exact', 'sketch'):
+            for workers in (1, 2):
+                requests = la.extract_info_from_file(log_file, error_percent, workers, aggregate)
+                report_data = la.prepare_report_data(requests, 10)
+                self.assertEqual([row['url'] for row in report_data],
+                                 [row['url'] for row in expected])
+                for row, expected_row in zip(report_data, expected):
+                    self.assertEqual(row['count'], expected_row['count'])
+                    self.assertEqual(row['time_sum'], expected_row['time_sum'])
+                    self.assertEqual(row['time_max'], expected_row['time_max'])
+                    self.assertAlmostEqual(row['time_med'], expected_row['time_med'],
+                                           delta=0.01 * expected_row['time_med'] + 0.001)
+
+    def test_unknown_aggregate(self):
+        log_file = la.LogFile(pathlib.Path('log/test_log'), date(2019, 1, 1), ext='')
+        self.assertRaises(ValueError, la.extract_info_from_file, log_file, 10, 1, 'unknown')
+
+
+class ParseRecordBytesTestCase(unittest.TestCase):
+    def test_ok(self):
+        line = b'1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] ' \
+               b'"GET /api/v2/banner/25019354 HTTP/1.1" 200 927 "-" ' \
+               b'"Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" ' \
+               b'"1498697422-2190034393-4708-9752759" "dc7161be3" 0.390'
+        self.assertEqual(la.parse_record_bytes(line), la.LogRecord(
+            1498697422, 'GET /api/v2/banner/25019354 HTTP/1.1', 200, 927, 0.39
+        ))
+
+    def test_bad_line(self):
+        for line in (b'error line',
+                     b'1.196.116.32 -  - [29/Jun/2017:03:50 +0300] "GET / HTTP/1.1" 200 927 '
+                     b'"-" "-" "-" "-" "-" 0.390',
+                     b'1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "GET / HTTP/1.1" 200 927 '
+                     b'"-" "-" "-" "-" "-" 0.ABC0'):
+            self.assertIsNone(la.parse_record_bytes(line))
+
+
+class ColumnsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = pathlib.Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def test_ok(self):
+        path = self.tmp_dir.joinpath('table')
+        rows = [(i, 'url{}'.format(i % 3), i * 0.5) for i in range(10)]
+        with mock.patch('columns.COLUMN_FLUSH_ROWS', 4):
+            with columns.ColumnWriter(path, (('id', 'q'), ('url', 'str'), ('time', 'd'))) as w:
+                for row in rows:
+                    w.append(row)
+                w.meta['source'] = 'test'
+
+        table = columns.load_columns(path)
+        self.assertEqual((table.meta, table.rows), ({'source': 'test'}, 10))
+        self.assertEqual(table.dictionaries, {'url': ['url0', 'url1', 'url2']})
+        self.assertEqual(list(zip(table.columns['id'],
+                                  [table.dictionaries['url'][i] for i in table.columns['url']],
+                                  table.columns['time'])), rows)
+        self.assertEqual(table.columns['time'].format, 'd')
+        self.assertFalse(path.with_name('table.tmp').exists())
+
+    def test_error(self):
+        path = self.tmp_dir.joinpath('table')
+        with self.assertRaises(RuntimeError):
+            with columns.ColumnWriter(path, (('id', 'q'),)) as w:
+                w.append((1,))
+                raise RuntimeError
+        self.assertEqual(list(self.tmp_dir.iterdir()), [])
+        self.assertIsNone(columns.load_columns(path))
+
+
+class ExtractInfoFromColumnsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = pathlib.Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def test_ok(self):
+        for path, ext in (('log/test_log', ''), ('log/test_log.gz', '.gz')):
+            log_file = la.LogFile(pathlib.Path(path), date(2019, 1, 1), ext)
+            for aggregate in ('list', 'exact'):
+                self.assertEqual(
+                    la.extract_info_from_columns(log_file, self.tmp_dir, 10, aggregate),
+                    la.extract_info_from_file(log_file, 10, aggregate=aggregate)
+                )
+
+    def test_reuse(self):
+        log_file = la.LogFile(pathlib.Path('log/test_log'), date(2019, 1, 1), '')
+        with self.assertLogs(level='INFO'):
+            la.extract_info_from_columns(log_file, self.tmp_dir, 10)
+        with mock.patch('log_analyzer.export_log_file') as export_log_file:
+            requests = la.extract_info_from_columns(
+                log_file, self.tmp_dir, 10,
+                url_normalizer=la.create_url_normalizer(collapse_ids=True)
+            )
+        export_log_file.assert_not_called()
+        self.assertEqual(requests['GET /api/v2/banner/{id} HTTP/1.1'], [0.39, 0.199])
+
+    def test_errors(self):
+        log_file = la.LogFile(pathlib.Path('log/test_log_error'), date(2019, 1, 1), '')
+        self.assertRaises(ValueError, la.extract_info_from_columns, log_file, self.tmp_dir, 10)
+        table = columns.load_columns(la.get_columns_path(self.tmp_dir, log_file.date))
+        self.assertGreater(table.meta['fails'], 0)
+
+
+class GetLogRangesTestCase(unittest.TestCase):
+    def test_ok(self):
+        log_file = la.LogFile(pathlib.Path('log/test_log'), date(2019, 1, 1), ext='')
+        with open('log/test_log', 'rb') as f:
+            data = f.read()
+
+        for workers in (1, 2, 3, 8):
+            ranges = la.get_log_ranges(log_file, workers)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], len(data))
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, start)
+                self.assertEqual(data[start - 1:start], b'\n')
+
+
+class StateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = pathlib.Path(tempfile.mkdtemp())
+        with open('log/test_log', 'rb') as f:
+            self.data = f.read()
+        self.expected = la.extract_info_from_file(
+            la.LogFile(pathlib.Path('log/test_log'), date(2019, 1, 1), ext=''), 10
+        )
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def test_plain_increment(self):
+        path = self.tmp_dir.joinpath('nginx-access-ui.log-20190101')
+        log_file = la.LogFile(path, date(2019, 1, 1), '')
+        for workers in (1, 2):
+            path.write_bytes(self.data[:450])
+            state = la.update_state(log_file, None, 10, workers)
+            self.assertEqual(state.offset, self.data.rfind(b'\n', 0, 450) + 1)
+            self.assertEqual(state.lines, 2)
+
+            path.write_bytes(self.data + b'\n')
+            state = la.update_state(log_file, state, 10, workers)
+            self.assertEqual(state.offset, len(self.data) + 1)
+            self.assertEqual(state.lines, 5)
+            self.assertEqual(state.requests, self.expected)
+
+        data = benchmark.generate_log(self.tmp_dir.joinpath('log'), 20000, 20).read_bytes()
+        for aggregate in ('list', 'exact', 'sketch'):
+            path.write_bytes(data)
+            expected = la.update_state(log_file, None, 10, aggregate=aggregate)
+            state = None
+            for size in (len(data) // 3, len(data) // 2, len(data)):
+                path.write_bytes(data[:size])
+                state = la.update_state(log_file, state, 10, 2, aggregate)
+            self.assertEqual(state.lines, 20000)
+            self.assertEqual(get_summaries(state.requests), get_summaries(expected.requests))
+
+    def test_gzip_increment(self):
+        path = self.tmp_dir.joinpath('nginx-access-ui.log-20190101.gz')
+        log_file = la.LogFile(path, date(2019, 1, 1), '.gz')
+        path.write_bytes(gzip.compress(self.data[:450]))
+        state = la.update_state(log_file, None, 10)
+        self.assertEqual(state.lines, 2)
+
+        path.write_bytes(gzip.compress(self.data + b'\n'))
+        state = la.update_state(log_file, state, 10)
+        self.assertEqual(state.lines, 5)
+        self.assertEqual(state.requests, self.expected)
+
+    def test_empty_log_increment(self):
+        path = self.tmp_dir.joinpath('nginx-access-ui.log-20190101')
+        log_file = la.LogFile(path, date(2019, 1, 1), '')
+        path.write_bytes(b'')
+        state = la.update_state(log_file, None, 10)
+        self.assertEqual((state.offset, state.lines, state.requests), (0, 0, {}))
+
+        path.write_bytes(self.data[:100])
+        state = la.update_state(log_file, state, 10)
+        self.assertEqual((state.offset, state.lines, state.requests), (0, 0, {}))
+
+        path.write_bytes(self.data + b'\n')
+        state = la.update_state(log_file, state, 10)
+        self.assertEqual(state.lines, 5)
+        self.assertEqual(state.requests, self.expected)
+
+        empty_path = self.tmp_dir.joinpath('nginx-access-ui.log-20181231')
+        empty_path.write_bytes(b'')
+        empty_state = la.update_state(la.LogFile(empty_path, date(2018, 12, 31), ''), None, 10)
+        lines, fails, requests = la.merge_states([empty_state, state])
+        self.assertEqual(lines, 5)
+        self.assertEqual(requests, self.expected)
+
+    def test_outdated_state(self):
+        path = self.tmp_dir.joinpath('nginx-access-ui.log-20190101')
+        log_file = la.LogFile(path, date(2019, 1, 1), '')
+        path.write_bytes(self.data + b'\n')
+        state = la.update_state(log_file, None, 10)
+
+        path.write_bytes(self.data[:450])
+        state = la.update_state(log_file, state, 10)
+        self.assertEqual(state.lines, 2)
+
+        state = la.update_state(log_file, state, 10, aggregate='exact')
+        self.assertEqual(state.lines, 2)
+        self.assertEqual(state.aggregate, 'exact')
+
+    def test_save_load(self):
+        path = self.tmp_dir.joinpath('nginx-access-ui.log-20190101')
+        log_file = la.LogFile(path, date(2019, 1, 1), '')
+        path.write_bytes(self.data)
+        state_path = la.get_state_path(self.tmp_dir.joinpath('report-2019.01.01.html'))
+        self.assertEqual(state_path.name, 'report-2019.01.01.state')
+
+        for aggregate in ('list', 'exact', 'sketch'):
+            state = la.update_state(log_file, None, 10, aggregate=aggregate)
+            la.save_state(state, state_path)
+            loaded = la.load_state(state_path)
+            self.assertEqual(loaded._replace(requests=None), state._replace(requests=None))
+            self.assertEqual(la.prepare_report_data(loaded.requests, 10),
+                             la.prepare_report_data(state.requests, 10))
+
+    def test_rollup(self):
+        for day in (1, 2):
+            path = self.tmp_dir.joinpath('nginx-access-ui.log-2019010{}'.format(day))
+            path.write_bytes(self.data + b'\n')
+            log_file = la.LogFile(path, date(2019, 1, day), '')
+            state = la.update_state(log_file, None, 10)
+            report_path = self.tmp_dir.joinpath('report-2019.01.0{}.html'.format(day))
+            la.save_state(state, la.get_state_path(report_path))
+
+        report_path = la.create_rollup_report(self.tmp_dir, date(2019, 1, 1), date(2019, 1, 3),
+                                              10)
+        self.assertEqual(report_path.name, 'report-2019.01.01-2019.01.03.html')
+        self.assertTrue(report_path.exists())
+        self.assertIsNone(la.create_rollup_report(self.tmp_dir, date(2019, 2, 1),
+                                                  date(2019, 2, 3), 10))
+
+        states = [la.load_state(self.tmp_dir.joinpath('report-2019.01.0{}.state'.format(day)))
+                  for day in (1, 2)]
+        lines, fails, requests = la.merge_states(states)
+        self.assertEqual(lines, 10)
+        self.assertEqual(requests, {url: request_times * 2
+                                    for url, request_times in self.expected.items()})
+
 
 class PrepareReportDataTestCase(unittest.TestCase):
     def test_ok(self):
@@ -164,6 +744,100 @@ class PrepareReportDataTestCase(unittest.TestCase):
             }
         ])
 
+    def test_percentiles(self):
+        request_times = [0.01 * i for i in range(1, 101)]
+        exact = ag.ExactStats()
+        sketch = ag.SketchStats()
+        for request_time in request_times:
+            exact.append(request_time)
+            sketch.append(request_time)
+
+        for requests in ({'url': request_times}, {'url': exact}):
+            row = la.prepare_report_data(requests, 1, [50, 90, 99.5])[0]
+            self.assertEqual(row['time_p50'], row['time_med'])
+            self.assertEqual(row['time_p90'], 0.901)
+            self.assertEqual(row['time_p99.5'], 0.995)
+
+        row = la.prepare_report_data({'url': sketch}, 1, [90, 99])[0]
+        self.assertAlmostEqual(row['time_p90'], 0.9, delta=0.01)
+        self.assertAlmostEqual(row['time_p99'], 0.99, delta=0.01)
+
+    def test_top_order(self):
+        requests = {
+            'url{}'.format(i): [0.1 * (i % 7), 0.2]
+            for i in range(50)
+        }
+        report_data = la.prepare_report_data(requests, 10)
+        expected = sorted(la.prepare_report_data(requests, 100),
+                          key=lambda row: row['time_sum'], reverse=True)[:10]
+        self.assertEqual(report_data, expected)
+        self.assertEqual(len(la.prepare_report_data(requests, 1000)), 50)
+
+    def test_exact(self):
+        requests = {}
+        for url, request_times in (('url1', [0.39, 0.24, 0.51]), ('url2', [0.45, 0.11]),
+                                   ('url3', [0.4])):
+            requests[url] = ag.ExactStats()
+            for request_time in request_times:
+                requests[url].append(request_time)
+        report_data = la.prepare_report_data(requests, 2)
+        self.assertEqual(report_data, la.prepare_report_data({
+            'url1': [0.39, 0.24, 0.51],
+            'url2': [0.45, 0.11],
+            'url3': [0.4],
+        }, 2))
+
+
+class SketchStatsTestCase(unittest.TestCase):
+    def test_error_bound(self):
+        accuracy = 0.01
+        values = [0.001 * 1.013 ** i for i in range(1000)] + [0.0] * 10
+        sketch = ag.SketchStats(accuracy)
+        for value in values:
+            sketch.append(value)
+
+        values.sort()
+        for q in (0.0, 0.1, 0.5, 0.9, 0.95, 0.99, 1.0):
+            exact = values[int(q * (len(values) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(q) - exact), accuracy * exact)
+        self.assertEqual(sketch.count, len(values))
+        self.assertAlmostEqual(sketch.total, sum(values))
+        self.assertEqual(sketch.max, values[-1])
+
+    def test_merge(self):
+        values = [0.01 * i for i in range(1, 500)]
+        sketch = ag.SketchStats()
+        part1 = ag.SketchStats()
+        part2 = ag.SketchStats()
+        for i, value in enumerate(values):
+            sketch.append(value)
+            (part1 if i % 2 else part2).append(value)
+        part1.extend(part2)
+
+        self.assertEqual(part1.bins, sketch.bins)
+        self.assertEqual(part1.count, sketch.count)
+        self.assertEqual(part1.total, sketch.total)
+        self.assertEqual(sketch.total, math.fsum(values))
+        self.assertEqual(part1.median(), sketch.median())
+        self.assertRaises(ValueError, part1.extend, ag.SketchStats(0.05))
+
+    def test_quantiles(self):
+        sketch = ag.SketchStats()
+        for value in [0.0] * 5 + [0.1 * i for i in range(1, 96)]:
+            sketch.append(value)
+        qs = [0.99, 0.0, 0.5, 0.04, 0.05, 1.0]
+        self.assertEqual(sketch.quantiles(qs), [sketch.quantile(q) for q in qs])
+        self.assertEqual(sketch.quantiles([0.0, 0.04]), [0.0, 0.0])
+        self.assertEqual(sketch.quantile(1.0), sketch.max)
+        self.assertRaises(ValueError, ag.SketchStats().quantile, 0.5)
+
+    def test_max_bins(self):
+        sketch = ag.SketchStats(max_bins=10)
+        for i in range(1, 100):
+            sketch.append(1.1 ** i)
+        self.assertEqual(len(sketch.bins), 10)
+        self.assertEqual(sum(sketch.bins.values()), 99)
+
 
 class CreateReportTestCase(unittest.TestCase):
     def test_ok(self):
@@ -196,8 +870,182 @@ class CreateReportTestCase(unittest.TestCase):
         path = la.create_report(report_data, report_dir, log_date)
         self.assertEqual(path, report_path)
 
+        with open('report.html', encoding='utf-8') as f:
+            expected = f.read().replace('$table_json', json.dumps(report_data))
+        with open(str(path), encoding='utf-8') as f:
+            self.assertEqual(f.read(), expected)
+        self.assertEqual(list(report_dir.glob('*.tmp')), [])
         path.unlink()
 
+    def test_empty(self):
+        report_path = pathlib.Path('reports/report-2019.01.01.html')
+        la.write_report([], report_path)
+        with open(str(report_path), encoding='utf-8') as f:
+            self.assertIn('var table = [];', f.read())
+        report_path.unlink()
+
+
+class LogFollowerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = pathlib.Path(tempfile.mkdtemp())
+        self.path = self.tmp_dir.joinpath('nginx-access-ui.log')
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def test_append(self):
+        follower = la.LogFollower(self.path)
+        self.assertEqual(follower.poll(), ([], False))
+
+        self.path.write_bytes(b'line1\nli')
+        self.assertEqual(follower.poll(), ([], False))
+        self.assertEqual(follower.poll(), ([b'line1'], False))
+        self.assertEqual(follower.poll(), ([], False))
+
+        with open(str(self.path), 'ab') as f:
+            f.write(b'ne2\nline3\n')
+        self.assertEqual(follower.poll(), ([b'line2', b'line3'], False))
+        follower.close()
+
+    def test_rotation(self):
+        self.path.write_bytes(b'line1\n')
+        follower = la.LogFollower(self.path)
+        self.assertEqual(follower.poll(), ([], False))
+        self.assertEqual(follower.poll(), ([b'line1'], False))
+
+        self.path.rename(self.tmp_dir.joinpath('nginx-access-ui.log-20190101'))
+        self.assertEqual(follower.poll(), ([], False))
+        self.path.write_bytes(b'line2\n')
+        self.assertEqual(follower.poll(), ([], True))
+        self.assertEqual(follower.poll(), ([b'line2'], False))
+        follower.close()
+
+    def test_truncation(self):
+        self.path.write_bytes(b'line1\nline2\n')
+        follower = la.LogFollower(self.path)
+        follower.poll()
+        follower.poll()
+        with open(str(self.path), 'wb') as f:
+            f.write(b'l3\n')
+        self.assertEqual(follower.poll(), ([], True))
+        self.assertEqual(follower.poll(), ([b'l3'], False))
+        follower.close()
+
+
+class FollowLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = pathlib.Path(tempfile.mkdtemp())
+        self.path = self.tmp_dir.joinpath('nginx-access-ui.log')
+        self.report_path = self.tmp_dir.joinpath('report-live.html')
+        with open('log/test_log', 'rb') as f:
+            self.lines = f.read().split(b'\n')
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def test_ok(self):
+        writes = [self.lines[:2], self.lines[2:], None, self.lines[:1], [], []]
+
+        def sleep(_):
+            lines = writes.pop(0)
+            if lines is None:
+                self.path.rename(self.tmp_dir.joinpath('nginx-access-ui.log-20190101'))
+                return
+            with open(str(self.path), 'ab') as f:
+                f.write(b''.join(line + b'\n' for line in lines))
+
+        config = dict(la.DEFAULT_CONFIG, FOLLOW_INTERVAL=0)
+        with mock.patch('logging.info') as info:
+            lines, fails, requests = la.follow_log(self.path, self.report_path, config,
+                                                   stop=lambda: not writes, sleep=sleep)
+        rotations = [call for call in info.call_args_list if 'was rotated' in call[0][0]]
+        self.assertEqual(len(rotations), 1)
+        self.assertEqual((lines, fails), (1, 0))
+        self.assertEqual(requests, {'GET /api/v2/banner/25019354 HTTP/1.1': [0.39]})
+        self.assertTrue(self.report_path.exists())
+
+
+class GenerateLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = pathlib.Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def test_ok(self):
+        for name in ('log', 'log.gz'):
+            path = benchmark.generate_log(self.tmp_dir.joinpath(name), 1000, 50)
+            log_file = la.LogFile(path, date(2017, 6, 30), path.suffix)
+            requests = la.extract_info_from_file(log_file, 0)
+            self.assertEqual(sum(len(request_times) for request_times in requests.values()),
+                             1000)
+            self.assertLessEqual(len(requests), 50)
+
+    def test_reproducible(self):
+        path1 = benchmark.generate_log(self.tmp_dir.joinpath('log1'), 100, 10, 0.1, seed=1)
+        path2 = benchmark.generate_log(self.tmp_dir.joinpath('log2'), 100, 10, 0.1, seed=1)
+        self.assertEqual(path1.read_bytes(), path2.read_bytes())
+        log_file = la.LogFile(path1, date(2017, 6, 30), '')
+        self.assertRaises(ValueError, la.extract_info_from_file, log_file, 1)
+
+
+class ErrorBudgetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = pathlib.Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp_dir))
+
+    def test_lower_bound(self):
+        self.assertEqual(la.get_error_lower_bound(0, 0), 0)
+        self.assertLessEqual(la.get_error_lower_bound(100, 0), 0)
+        self.assertLess(la.get_error_lower_bound(100, 20), 10)
+        self.assertTrue(18 < la.get_error_lower_bound(10000, 2000) < 20)
+        self.assertLess(la.get_error_lower_bound(10000, 2000, z=5),
+                        la.get_error_lower_bound(10000, 2000, z=3))
+
+    def test_sample(self):
+        for name in ('log', 'log.gz'):
+            path = benchmark.generate_log(self.tmp_dir.joinpath(name), 30000, 10, 0.5)
+            log_file = la.LogFile(path, date(2017, 6, 30), path.suffix)
+            with mock.patch('log_analyzer.aggregate_requests') as aggregate_requests:
+                self.assertRaises(ValueError, la.extract_info_from_file, log_file, 10)
+            aggregate_requests.assert_not_called()
+            la.check_error_sample(log_file, 60)
+
+        path = self.tmp_dir.joinpath('log')
+        lines = sum(1 for _ in la.sample_log_lines(la.LogFile(path, None, ''), 1000))
+        self.assertEqual(lines, 2000)
+
+        log_file = la.LogFile(path, date(2017, 6, 30), '')
+        with mock.patch('log_analyzer.check_error_sample'), \
+                mock.patch('log_analyzer.aggregate_requests',
+                           return_value=(0, 0, {})) as aggregate_requests:
+            la.extract_info_from_file(log_file, 10, error_check_lines=500)
+        self.assertEqual(aggregate_requests.call_args[0][1].error_check_lines, 500)
+
+    def test_running_check(self):
+        parsed = 0
+
+        def parse():
+            nonlocal parsed
+            for i in range(100000):
+                parsed += 1
+                yield None if i % 2 else la.LogLine('GET / HTTP/1.1', 0.1)
+
+        options = la.AggregateOptions(list, None, 0, 10)
+        self.assertRaises(ValueError, la.aggregate_requests, parse(), options)
+        self.assertEqual(parsed, la.ERROR_CHECK_LINES)
+
+        parsed = 0
+        options = la.AggregateOptions(list, None, 0, 10, 1000)
+        self.assertRaises(ValueError, la.aggregate_requests, parse(), options)
+        self.assertEqual(parsed, 1000)
+
+        options = la.AggregateOptions(list, None, 0, 60)
+        self.assertEqual(la.aggregate_requests(parse(), options)[:2], (100000, 50000))
+        self.assertEqual(la.aggregate_requests(parse())[:2], (100000, 50000))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -21,10 +21,20 @@
 Вам наверняка пригодится itertools.
 Можно свободно определять свои функции и т.п.
 """
-from itertools import combinations, groupby, product
+from itertools import combinations, combinations_with_replacement, groupby, product
+import random
+import sys
+import timeit
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 RANKS = '23456789TJQKA'
+SUITS = 'CSHD'
+PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
 JOKER_COMBINATIONS = {
     '?B': [rank + suit for rank, suit in product(RANKS, 'CS')],
     '?R': [rank + suit for rank, suit in product(RANKS, 'HD')],
@@ -32,28 +42,94 @@ JOKER_COMBINATIONS = {
 
 
 def hand_rank(hand):
-    """Возвращает значение определяющее ранг 'руки'"""
+    """
+    Возвращает значение определяющее ранг 'руки'
+    (совместимая обертка над hand_value, значения совпадают с reference_hand_rank;
+    списки рангов копируются, чтобы изменение результата не портило общую таблицу)
+    """
+    rank = HAND_RANKS[hand_value(*(CARD_CODES[card] for card in hand))]
+    return tuple(list(item) if isinstance(item, list) else item for item in rank)
+
+
+def reference_hand_rank(hand):
+    """Возвращает значение определяющее ранг 'руки' (эталонная реализация)"""
     ranks = card_ranks(hand)
     if straight(ranks) and flush(hand):
         return 8, max(ranks)
-    elif kind(4, ranks):
+    elif kind(4, ranks) is not None:
         return 7, kind(4, ranks), kind(1, ranks)
-    elif kind(3, ranks) and kind(2, ranks):
+    elif kind(3, ranks) is not None and kind(2, ranks) is not None:
         return 6, kind(3, ranks), kind(2, ranks)
     elif flush(hand):
         return 5, ranks
     elif straight(ranks):
         return 4, max(ranks)
-    elif kind(3, ranks):
+    elif kind(3, ranks) is not None:
         return 3, kind(3, ranks), ranks
     elif two_pair(ranks):
         return 2, two_pair(ranks), ranks
-    elif kind(2, ranks):
+    elif kind(2, ranks) is not None:
         return 1, kind(2, ranks), ranks
     else:
         return 0, ranks
 
 
+def encode_card(card):
+    """
+    Кодирует карту целым числом: биты 16-28 - ранг (бит на ранг), 12-15 - масть (бит на
+    масть), 8-11 - номер ранга, 0-7 - простое число ранга
+    """
+    rank = RANKS.index(card[0])
+    suit = SUITS.index(card[1])
+    return 1 << (16 + rank) | 1 << (12 + suit) | rank << 8 | PRIMES[rank]
+
+
+def hand_value(c1, c2, c3, c4, c5):
+    """
+    Возвращает ранг 'руки' из 5ти закодированных карт в виде числа (чем больше, тем сильнее
+    'рука'). Флеши ищутся в таблице по битовой маске рангов, остальные 'руки' - по
+    произведению простых чисел рангов
+    """
+    if c1 & c2 & c3 & c4 & c5 & 0xF000:
+        return FLUSH_VALUES[(c1 | c2 | c3 | c4 | c5) >> 16]
+    return PRIME_VALUES[(c1 & 0xFF) * (c2 & 0xFF) * (c3 & 0xFF) * (c4 & 0xFF) * (c5 & 0xFF)]
+
+
+def build_tables():
+    """
+    Строит таблицы рангов 'рук': перебирает все наборы рангов 5ти карт (и флеши),
+    вычисляет для них reference_hand_rank и нумерует значения по возрастанию
+    """
+    flush_ranks = {}
+    prime_ranks = {}
+    for ranks in combinations_with_replacement(range(13), 5):
+        if any(ranks.count(rank) > 4 for rank in ranks):
+            continue
+        key = 1
+        for rank in ranks:
+            key *= PRIMES[rank]
+        if len(set(ranks)) == 5:
+            hand = [RANKS[rank] + 'C' for rank in ranks]
+            bits = sum(1 << rank for rank in ranks)
+            flush_ranks[bits] = reference_hand_rank(hand)
+            hand[-1] = hand[-1][0] + 'S'
+        else:
+            hand = [RANKS[rank] + SUITS[ranks[:i].count(rank)] for i, rank in enumerate(ranks)]
+        prime_ranks[key] = reference_hand_rank(hand)
+
+    hand_ranks = sorted({repr(rank): rank for rank in
+                         list(flush_ranks.values()) + list(prime_ranks.values())}.values())
+    values = {repr(rank): value for value, rank in enumerate(hand_ranks)}
+    flush_values = [None] * (1 << 13)
+    for bits, rank in flush_ranks.items():
+        flush_values[bits] = values[repr(rank)]
+    prime_values = {key: values[repr(rank)] for key, rank in prime_ranks.items()}
+    return hand_ranks, flush_values, prime_values
+
+
+CARD_CODES = {rank + suit: encode_card(rank + suit) for rank, suit in product(RANKS, SUITS)}
+
+
 def card_ranks(hand):
     """
     Возвращает список рангов (его числовой эквивалент), отсортированный от большего к меньшему
@@ -94,21 +170,212 @@ def two_pair(ranks):
     """
     pair1 = kind(2, ranks)
     pair2 = kind(2, ranks[::-1])
-    if pair1 and pair1 != pair2:
+    if pair1 is not None and pair1 != pair2:
         return pair1, pair2
     return None
 
 
+HAND_RANKS, FLUSH_VALUES, PRIME_VALUES = build_tables()
+
+
+def straight_top(bits):
+    """
+    Возвращает старший ранг последовательности 5ти рангов в битовой маске рангов или None
+    """
+    for top in range(12, 3, -1):
+        mask = 0x1F << (top - 4)
+        if bits & mask == mask:
+            return top
+    return None
+
+
+def best_hand_indexes(codes):
+    """
+    Возвращает номера 5ти карт лучшей 'руки' среди закодированных карт без перебора
+    сочетаний: флеш ищется по гистограмме мастей, стрит - по битовой маске рангов,
+    каре, сеты и пары - по гистограмме рангов. Из карт одного ранга выбираются карты с
+    меньшими номерами, поэтому результат совпадает с первым лучшим сочетанием
+    """
+    ranks = [code >> 8 & 0xF for code in codes]
+    order = sorted(range(len(codes)), key=ranks.__getitem__, reverse=True)
+    suits = [code & 0xF000 for code in codes]
+    bits = 0
+    for code in codes:
+        bits |= code >> 16
+
+    flush = None
+    for suit in set(suits):
+        if suits.count(suit) >= 5:
+            flush = [i for i in order if suits[i] == suit]
+            flush_bits = 0
+            for i in flush:
+                flush_bits |= codes[i] >> 16
+            top = straight_top(flush_bits)
+            if top is not None:
+                return [i for i in flush if top - 4 <= ranks[i] <= top]
+
+    counts = [0] * len(RANKS)
+    for rank in ranks:
+        counts[rank] += 1
+    groups = sorted(set(ranks), key=lambda rank: (counts[rank], rank), reverse=True)
+    first = counts[groups[0]]
+    second = counts[groups[1]] if len(groups) > 1 else 0
+    if first == 4:
+        used = groups[:1]
+    elif first == 3 and second >= 2:
+        return [i for i in order if ranks[i] == groups[0]] + \
+            [i for i in order if ranks[i] == groups[1]][:2]
+    elif flush:
+        return flush[:5]
+    else:
+        top = straight_top(bits)
+        if top is not None:
+            return [by_rank[0] for by_rank in (
+                [i for i in order if ranks[i] == rank] for rank in range(top, top - 5, -1)
+            )]
+        used = groups[:2] if first == second == 2 else groups[:1] if first > 1 else []
+
+    indexes = [i for i in order if ranks[i] in used]
+    return indexes + [i for i in order if ranks[i] not in used][:5 - len(indexes)]
+
+
 def best_hand(hand):
     """
     Из "руки" в 7 карт возвращает лучшую "руку" в 5 карт
     """
-    return max(combinations(hand, 5), key=hand_rank)
+    indexes = best_hand_indexes([CARD_CODES[card] for card in hand])
+    return tuple(hand[i] for i in sorted(indexes))
+
+
+def build_batch_tables():
+    """
+    Возвращает таблицы рангов для best_hands_batch в виде массивов numpy: коды всех карт,
+    ранги флешей по битовой маске рангов (-1 для масок не из 5ти рангов), отсортированные
+    произведения простых чисел рангов и соответствующие им ранги
+    """
+    prime_keys = sorted(PRIME_VALUES)
+    return (
+        np.array(sorted(CARD_CODES.values()), dtype=np.int32),
+        np.array([-1 if value is None else value for value in FLUSH_VALUES], dtype=np.int32),
+        np.array(prime_keys, dtype=np.int32),
+        np.array([PRIME_VALUES[key] for key in prime_keys], dtype=np.int32),
+    )
+
+
+BATCH_CHUNK_SIZE = 64 * 1024
+BATCH_TABLES = build_batch_tables() if np is not None else None
+
+
+def encode_hands(hands):
+    """Возвращает массив numpy N x M закодированных карт N 'рук' из M карт"""
+    if np is None:
+        raise RuntimeError('numpy is required for batch evaluation')
+    return np.array([[CARD_CODES[card] for card in hand] for hand in hands], dtype=np.int32)
+
+
+def best_hands_batch(codes, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    Векторизованный best_hand для массива N x M (M >= 5) закодированных карт: все сочетания
+    5ти карт оцениваются сразу для chunk_size 'рук' операциями над массивами (флеш - по
+    битам мастей и таблице битовых масок рангов, остальные 'руки' - бинарным поиском
+    произведения простых чисел рангов). Возвращает массив N рангов (значений hand_value) и
+    массив N x 5 упорядоченных номеров карт первой лучшей 'руки', как у best_hand
+    """
+    if np is None:
+        raise RuntimeError('numpy is required for batch evaluation')
+    card_codes, flush_values, prime_keys, prime_values = BATCH_TABLES
+    codes = np.asarray(codes, dtype=np.int32)
+    if codes.ndim != 2 or codes.shape[1] < 5:
+        raise ValueError('Expected N x M array of encoded cards with M >= 5')
+    if not np.isin(codes, card_codes).all():
+        raise ValueError('Unknown card codes')
+    sorted_codes = np.sort(codes, axis=1)
+    if (sorted_codes[:, 1:] == sorted_codes[:, :-1]).any():
+        raise ValueError('Repeated cards in hand')
+
+    indexes = np.array(list(combinations(range(codes.shape[1]), 5)))
+    values = np.empty(len(codes), dtype=np.int32)
+    best = np.empty(len(codes), dtype=np.intp)
+    for start in range(0, len(codes), chunk_size):
+        cards = codes[start:start + chunk_size, indexes]
+        suits = np.bitwise_and.reduce(cards, axis=2) & 0xF000
+        bits = np.bitwise_or.reduce(cards, axis=2) >> 16
+        primes = np.prod(cards & 0xFF, axis=2, dtype=np.int32)
+        chunk_values = np.where(suits != 0, flush_values[bits],
+                                prime_values[np.searchsorted(prime_keys, primes)])
+        chunk_best = chunk_values.argmax(axis=1)
+        values[start:start + chunk_size] = chunk_values[np.arange(len(cards)), chunk_best]
+        best[start:start + chunk_size] = chunk_best
+    return values, indexes[best]
+
+
+def joker_candidates(joker, common_cards, jokers):
+    """
+    Возвращает карты, которыми может быть выгодно заменить джокера: ранги карт 'руки'
+    (каре, сеты, пары), недостающие ранги последовательностей, которые можно дополнить
+    джокерами до стрита, старшие отсутствующие ранги (кикеры) и старшая недостающая карта
+    масти, которую джокер дополняет до флеша. Масть важна только для флеша, поэтому для
+    остальных рангов берется одна карта
+    """
+    options = [card for card in JOKER_COMBINATIONS[joker] if card not in common_cards]
+    present = {card[0] for card in common_cards}
+    ranks = set(present)
+    for top in range(4, len(RANKS)):
+        window = RANKS[top - 4:top + 1]
+        if sum(rank in present for rank in window) >= 5 - jokers:
+            ranks.update(window)
+    ranks.update([rank for rank in RANKS if rank not in present][-jokers:])
+
+    suits = [card[1] for card in common_cards]
+    flush_suits = {card[1] for card in options if suits.count(card[1]) >= 4}
+    candidates = []
+    for rank in RANKS[::-1]:
+        cards = [card for card in options if card[0] == rank]
+        flush_cards = [card for card in cards if card[1] in flush_suits]
+        for suit in flush_suits:
+            if not any(card[1] == suit for card in candidates) and rank + suit in cards:
+                candidates.append(rank + suit)
+        if rank in ranks:
+            candidates += [card for card in flush_cards if card not in candidates]
+            candidates += [card for card in cards if card not in flush_cards][:1]
+    return candidates
 
 
 def best_wild_hand(hand):
     """
     best_hand но с джокерами
+
+    Джокеры заменяются только картами из joker_candidates, а 'руки' с одинаковыми рангами
+    и картами мастей флеша оцениваются один раз
+    """
+    common_cards = [card for card in hand if card not in JOKER_COMBINATIONS]
+    jokers = [card for card in hand if card in JOKER_COMBINATIONS]
+    if not jokers:
+        return best_hand(hand)
+
+    candidates = [joker_candidates(joker, common_cards, len(jokers)) for joker in jokers]
+    values = {}
+    best = None
+    best_value = -1
+    for joker_combination in product(*candidates):
+        cards = common_cards + list(joker_combination)
+        suits = [card[1] for card in cards]
+        key = (''.join(sorted(card[0] for card in cards)),
+               frozenset(card for card in cards if suits.count(card[1]) >= 5))
+        if key in values:
+            continue
+        codes = [CARD_CODES[card] for card in cards]
+        indexes = best_hand_indexes(codes)
+        value = values[key] = hand_value(*(codes[i] for i in indexes))
+        if value > best_value:
+            best = tuple(cards[i] for i in sorted(indexes))
+            best_value = value
+    return best
+
+
+def reference_best_wild_hand(hand):
+    """
+    best_hand но с джокерами (эталонная реализация с перебором всех замен джокеров)
     """
     common_cards = [card for card in hand if card not in JOKER_COMBINATIONS]
     joker_combinations = [
@@ -123,6 +390,52 @@ def best_wild_hand(hand):
     return max(best_hands, key=hand_rank)
 
 
+def random_hands(count, size, seed=0):
+    """Возвращает count случайных 'рук' из size карт"""
+    rnd = random.Random(seed)
+    deck = list(CARD_CODES)
+    return [rnd.sample(deck, size) for _ in range(count)]
+
+
+def test_hand_rank():
+    print('test_hand_rank...')
+    assert hand_rank('2C 2D 2H 2S KD'.split()) == (7, 0, 11)
+    assert hand_rank('2C 2D 2H KS KD'.split()) == (6, 0, 11)
+    assert hand_rank('AC 2D 3H 4S 5D'.split()) == (0, [12, 3, 2, 1, 0])
+    rank = hand_rank('AC 2D 3H 4S 6D'.split())
+    rank[1].clear()
+    assert hand_rank('AC 2D 3H 4S 6D'.split()) == (0, [12, 4, 2, 1, 0])
+    assert hand_rank('9H TH JH QH KH'.split()) > hand_rank('AC AD AH AS KD'.split())
+    for hand in random_hands(20000, 5):
+        assert hand_rank(hand) == reference_hand_rank(hand)
+    print('OK')
+
+
+def benchmark_hand_rank(count=20000):
+    """
+    Печатает скорость вычисления рангов 'рук' из 5ти карт и лучших 'рук' из 7ми карт (без
+    джокеров и с джокерами)
+    """
+    hands = random_hands(count, 5)
+    for func in (reference_hand_rank, hand_rank):
+        seconds = min(timeit.repeat(lambda: [func(hand) for hand in hands], number=1, repeat=3))
+        print('{:<20} {:>10.0f} hands/sec'.format(func.__name__, count / seconds))
+    hands = random_hands(count // 10, 7)
+    for name, func in (('combinations', lambda hand: max(combinations(hand, 5), key=hand_rank)),
+                       ('best_hand', best_hand)):
+        seconds = min(timeit.repeat(lambda: [func(hand) for hand in hands], number=1, repeat=3))
+        print('{:<20} {:>10.0f} hands/sec'.format(name, len(hands) / seconds))
+    if np is not None:
+        hands = random_hands(count * 5, 7)
+        codes = encode_hands(hands)
+        seconds = min(timeit.repeat(lambda: best_hands_batch(codes), number=1, repeat=3))
+        print('{:<20} {:>10.0f} hands/sec'.format('best_hands_batch', len(hands) / seconds))
+    hands = random_wild_hands(count // 100)
+    for func in (reference_best_wild_hand, best_wild_hand):
+        seconds = min(timeit.repeat(lambda: [func(hand) for hand in hands], number=1, repeat=3))
+        print('{:<20} {:>10.0f} hands/sec'.format(func.__name__, len(hands) / seconds))
+
+
 def test_best_hand():
     print('test_best_hand...')
     assert (sorted(best_hand('6C 7C 8C 9C TC 5C JS'.split()))
@@ -131,6 +444,77 @@ def test_best_hand():
             == ['8C', '8S', 'TC', 'TD', 'TH'])
     assert (sorted(best_hand('JD TC TH 7C 7D 7S 7H'.split()))
             == ['7C', '7D', '7H', '7S', 'JD'])
+    for hand in random_hands(5000, 7):
+        assert best_hand(hand) == max(combinations(hand, 5), key=reference_hand_rank)
+    print('OK')
+
+
+def test_best_hands_batch():
+    print('test_best_hands_batch...')
+    if np is None:
+        print('numpy is not installed, skipped')
+        return
+    hands = random_hands(5000, 7) + ['6C 7C 8C 9C TC 5C JS'.split(),
+                                     'TD TC TH 7C 7D 8C 8S'.split()]
+    values, indexes = best_hands_batch(encode_hands(hands), chunk_size=1000)
+    for hand, value, hand_indexes in zip(hands, values.tolist(), indexes.tolist()):
+        assert tuple(hand[i] for i in hand_indexes) == best_hand(hand), hand
+        assert value == hand_value(*(CARD_CODES[hand[i]] for i in hand_indexes)), hand
+    values, indexes = best_hands_batch(encode_hands(random_hands(1000, 5)))
+    assert indexes.tolist() == [[0, 1, 2, 3, 4]] * 1000
+    assert values.tolist() == [hand_value(*(CARD_CODES[card] for card in hand))
+                               for hand in random_hands(1000, 5)]
+    for hand in (['AS'] * 5, 'AS KS QS JS TS 9S AS'.split()):
+        try:
+            best_hands_batch(encode_hands([hand]))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('Repeated cards accepted: {}'.format(hand))
+    print('OK')
+
+
+def random_wild_hands(count, seed=0):
+    """Возвращает count случайных 'рук' из 7ми карт с одним или двумя джокерами"""
+    rnd = random.Random(seed)
+    deck = list(CARD_CODES)
+    hands = []
+    for i in range(count):
+        jokers = ['?B', '?R'] if i % 3 == 0 else [rnd.choice(['?B', '?R'])]
+        hands.append(rnd.sample(deck, 7 - len(jokers)) + jokers)
+    return hands
+
+
+def check_wild_hand(hand, expected):
+    """
+    Проверяет, что best_wild_hand возвращает допустимую 'руку' того же ранга, что и
+    expected
+    """
+    result = best_wild_hand(hand)
+    common_cards = [card for card in hand if card not in JOKER_COMBINATIONS]
+    substitutes = [card for card in result if card not in common_cards]
+    jokers = [card for card in hand if card in JOKER_COMBINATIONS]
+    assert len(result) == len(set(result)) == 5, (hand, result)
+    assert len(substitutes) <= len(jokers), (hand, result)
+    assert all(any(card in JOKER_COMBINATIONS[joker] for joker in jokers)
+               for card in substitutes), (hand, result)
+    assert len({joker for card in substitutes for joker in jokers
+                if card in JOKER_COMBINATIONS[joker]}) == len(substitutes), (hand, result)
+    assert hand_rank(result) == hand_rank(expected), (hand, result, expected)
+
+
+def test_best_wild_hand_exhaustive():
+    """
+    Сравнивает best_wild_hand с полным перебором на всех 'руках' с двумя джокерами из пяти
+    карт старших рангов и на случайных 'руках'
+    """
+    print('test_best_wild_hand_exhaustive...')
+    deck = [rank + suit for rank, suit in product('TJQKA', SUITS)]
+    for common_cards in combinations(deck, 5):
+        hand = list(common_cards) + ['?B', '?R']
+        check_wild_hand(hand, reference_best_wild_hand(hand))
+    for hand in random_wild_hands(5000):
+        check_wild_hand(hand, reference_best_wild_hand(hand))
     print('OK')
 
 
@@ -142,8 +526,17 @@ def test_best_wild_hand():
             == ['7C', 'TC', 'TD', 'TH', 'TS'])
     assert (sorted(best_wild_hand('JD TC TH 7C 7D 7S 7H'.split()))
             == ['7C', '7D', '7H', '7S', 'JD'])
+    for hand in random_wild_hands(200):
+        check_wild_hand(hand, reference_best_wild_hand(hand))
     print('OK')
 
 if __name__ == '__main__':
-    test_best_hand()
-    test_best_wild_hand()
+    if sys.argv[1:] == ['benchmark']:
+        benchmark_hand_rank()
+    elif sys.argv[1:] == ['exhaustive']:
+        test_best_wild_hand_exhaustive()
+    else:
+        test_hand_rank()
+        test_best_hand()
+        test_best_hands_batch()
+        test_best_wild_hand()
@@ -0,0 +1,418 @@
+import asyncio
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import deco
+
+
+class MakeKeyTestCase(unittest.TestCase):
+    def test_types(self):
+        keys = {deco.make_key((value,), {}) for value in (1, 1.0, True)}
+        self.assertEqual(len(keys), 3)
+        keys = {deco.make_key((), {'x': value}) for value in (1, 1.0, True)}
+        self.assertEqual(len(keys), 3)
+
+    def test_kwargs_order(self):
+        self.assertEqual(deco.make_key((1,), {'a': 2, 'b': 3}),
+                         deco.make_key((1,), {'b': 3, 'a': 2}))
+        self.assertNotEqual(deco.make_key((1, 2), {}), deco.make_key((1,), {'x': 2}))
+
+    def test_unhashable(self):
+        self.assertEqual(deco.make_key(([1, 2],), {}), deco.make_key(([1, 2],), {}))
+        self.assertNotEqual(deco.make_key(([1],), {}), deco.make_key(([1.0],), {}))
+
+
+class MemoTestCase(unittest.TestCase):
+    def test_types(self):
+        @deco.memo
+        def type_name(x):
+            return type(x).__name__
+
+        self.assertEqual([type_name(1), type_name(1.0), type_name(True)],
+                         ['int', 'float', 'bool'])
+
+    def test_lru_types(self):
+        @deco.lru_memo(maxsize=None)
+        def type_name(x):
+            return type(x).__name__
+
+        self.assertEqual([type_name(1), type_name(1.0), type_name(True)],
+                         ['int', 'float', 'bool'])
+        self.assertEqual(type_name.misses, 3)
+
+    def test_lru_eviction(self):
+        calls = []
+
+        @deco.lru_memo(maxsize=2)
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        self.assertEqual([square(1), square(2), square(1), square(3)], [1, 4, 1, 9])
+        self.assertEqual(calls, [1, 2, 3])
+        self.assertEqual((square.hits, square.misses, square.evictions), (1, 3, 1))
+        self.assertEqual([square(1), square(3), square(2)], [1, 9, 4])
+        self.assertEqual(calls, [1, 2, 3, 2])
+        self.assertEqual((square.hits, square.misses, square.evictions), (3, 4, 2))
+        self.assertEqual(square(1), 1)
+        self.assertEqual(calls, [1, 2, 3, 2, 1])
+
+    def test_lru_ttl(self):
+        now = [0.0]
+        calls = []
+
+        @deco.lru_memo(ttl=10, timer=lambda: now[0])
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        square(2)
+        now[0] = 9.5
+        square(2)
+        self.assertEqual(calls, [2])
+        now[0] = 10.0
+        square(2)
+        self.assertEqual(calls, [2, 2])
+        self.assertEqual((square.hits, square.misses, square.evictions), (1, 2, 1))
+        now[0] = 19.0
+        square(2)
+        self.assertEqual(calls, [2, 2])
+
+    def test_lru_cache_clear(self):
+        calls = []
+
+        @deco.lru_memo()
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        square(2)
+        square(2)
+        square.cache_clear()
+        self.assertEqual((square.hits, square.misses, square.evictions), (0, 0, 0))
+        square(2)
+        self.assertEqual(calls, [2, 2])
+        self.assertEqual((square.hits, square.misses, square.evictions), (0, 1, 0))
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    workers = 8
+
+    def run_concurrently(self, func):
+        barrier = threading.Barrier(self.workers)
+
+        def call():
+            barrier.wait()
+            try:
+                return func(1)
+            except ValueError as e:
+                return e
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            return [future.result() for future in
+                    [executor.submit(call) for _ in range(self.workers)]]
+
+    def test_threads(self):
+        calls = []
+
+        @deco.memo
+        def slow(x):
+            calls.append(x)
+            time.sleep(0.05)
+            return object()
+
+        results = self.run_concurrently(slow)
+        self.assertEqual(calls, [1])
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertIs(slow(1), results[0])
+
+    def test_error(self):
+        calls = []
+
+        @deco.lru_memo()
+        def fail(x):
+            calls.append(x)
+            time.sleep(0.05)
+            raise ValueError(len(calls))
+
+        errors = self.run_concurrently(fail)
+        self.assertEqual(calls, [1])
+        self.assertTrue(all(isinstance(error, ValueError) and error.args == (1,)
+                            for error in errors))
+        self.assertRaises(ValueError, fail, 1)
+        self.assertEqual(calls, [1, 1])
+        self.assertEqual(fail.misses, self.workers + 1)
+        self.assertEqual(fail.hits, 0)
+
+    def test_same_thread_recursion(self):
+        calls = []
+
+        @deco.memo
+        def reenter(x):
+            calls.append(x)
+            return reenter(x) + 1 if len(calls) == 1 else 0
+
+        self.assertEqual(reenter(1), 1)
+        self.assertEqual(reenter(1), 1)
+        self.assertEqual(calls, [1, 1])
+
+    def test_recursion_depth(self):
+        @deco.memo
+        def fib(n):
+            return 1 if n <= 1 else fib(n - 1) + fib(n - 2)
+
+        a, b = 1, 1
+        for _ in range(400):
+            a, b = b, a + b
+        self.assertEqual(fib(400), a)
+
+    def test_async(self):
+        calls = []
+
+        @deco.memo
+        async def slow(x):
+            calls.append(x)
+            await asyncio.sleep(0.01)
+            return x * 2
+
+        async def run():
+            results = await asyncio.gather(slow(1), slow(1), slow(2), slow(1))
+            return results + [await slow(1)]
+
+        self.assertEqual(asyncio.run(run()), [2, 2, 4, 2, 2])
+        self.assertEqual(sorted(calls), [1, 2])
+
+    def test_async_threads(self):
+        calls = []
+
+        @deco.lru_memo()
+        async def slow(x):
+            calls.append(x)
+            await asyncio.sleep(0.05)
+            return x * 2
+
+        async def run():
+            return await asyncio.gather(slow(1), slow(1))
+
+        barrier = threading.Barrier(self.workers)
+
+        def call():
+            barrier.wait()
+            return asyncio.run(run())
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            results = [future.result() for future in
+                       [executor.submit(call) for _ in range(self.workers)]]
+        self.assertEqual(results, [[2, 2]] * self.workers)
+        self.assertLessEqual(len(calls), self.workers)
+        self.assertEqual(asyncio.run(slow(1)), 2)
+
+
+class PersistentKeyTestCase(unittest.TestCase):
+    def test_canonical(self):
+        key = deco.make_persistent_key
+        self.assertEqual(key(({'a': 1, 'b': {'x', 'y'}},), {}),
+                         key(({'b': {'y', 'x'}, 'a': 1},), {}))
+        self.assertEqual(key((), {'a': 1, 'b': 2}), key((), {'b': 2, 'a': 1}))
+        self.assertNotEqual(key((OrderedDict(a=1, b=2),), {}), key((OrderedDict(b=2, a=1),), {}))
+        self.assertNotEqual(key(({'a'},), {}), key((frozenset('a'),), {}))
+        self.assertNotEqual(key(([1],), {}), key(((1,),), {}))
+        self.assertNotEqual(key((1,), {}), key((1.0,), {}))
+
+    def test_hash_seed(self):
+        code = 'import deco; print(deco.make_persistent_key(' \
+               '(frozenset("abcdefgh"), {"x", "y", "z"}), {"d": {"q": 1, "p": 2}}))'
+        keys = set()
+        for seed in ('1', '2', '3'):
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            keys.add(subprocess.check_output([sys.executable, '-c', code], env=env,
+                                             cwd=os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(len(keys), 1)
+
+
+class PersistentMemoTestCase(unittest.TestCase):
+    script = """
+import shelve
+import sys
+
+import deco
+
+if sys.argv[1] == 'sqlite':
+    backend = deco.SQLiteBackend(sys.argv[2])
+else:
+    backend = deco.MappingBackend(shelve.open(sys.argv[2]))
+
+
+@deco.persistent_memo(backend)
+def square(x):
+    print('computed')
+    return x * {factor}
+
+
+print(square(3))
+if sys.argv[1] == 'shelve':
+    backend.mapping.close()
+"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def run_script(self, backend, factor='x'):
+        path = os.path.join(self.dir.name, 'square.py')
+        with open(path, 'w') as f:
+            f.write(self.script.format(factor=factor))
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output(
+            [sys.executable, path, backend, os.path.join(self.dir.name, 'memo')], env=env)
+        return output.decode().split()
+
+    def check_restart(self, backend):
+        self.assertEqual(self.run_script(backend), ['computed', '9'])
+        self.assertEqual(self.run_script(backend), ['9'])
+        self.assertEqual(self.run_script(backend, factor='(x + 1)'), ['computed', '12'])
+        self.assertEqual(self.run_script(backend, factor='(x + 1)'), ['12'])
+        self.assertEqual(self.run_script(backend), ['computed', '9'])
+
+    def test_sqlite_restart(self):
+        self.check_restart('sqlite')
+
+    def test_shelve_restart(self):
+        self.check_restart('shelve')
+
+    def test_version(self):
+        path = os.path.join(self.dir.name, 'memo.sqlite')
+        calls = []
+
+        def make_square(version):
+            backend = deco.SQLiteBackend(path)
+            self.addCleanup(backend.close)
+
+            @deco.persistent_memo(backend, version=version)
+            def square(x):
+                calls.append(x)
+                return x * x
+            return square
+
+        self.assertEqual(make_square('1')(3), 9)
+        self.assertEqual(make_square('1')(3), 9)
+        self.assertEqual(calls, [3])
+        self.assertEqual(make_square('2')(3), 9)
+        self.assertEqual(calls, [3, 3])
+        self.assertEqual(make_square('1')(3), 9)
+        self.assertEqual(calls, [3, 3, 3])
+
+
+class NAryTestCase(unittest.TestCase):
+    def test_right_fold(self):
+        sub = deco.n_ary(lambda x, y: x - y)
+        self.assertEqual(sub(10, 4, 3), 10 - (4 - 3))
+        self.assertEqual(sub(1, 2, 3, 4, 5), 1 - (2 - (3 - (4 - 5))))
+        self.assertEqual(sub(10, 4), 6)
+
+    def test_left_fold(self):
+        sub = deco.n_ary_left(lambda x, y: x - y)
+        self.assertEqual(sub(10, 4, 3), (10 - 4) - 3)
+        self.assertEqual(sub(1, 2, 3, 4, 5), 1 - 2 - 3 - 4 - 5)
+
+    def test_single_argument(self):
+        marker = object()
+        for n_ary in (deco.n_ary, deco.n_ary_left, deco.n_ary_tree):
+            self.assertIs(n_ary(lambda x, y: None)(marker), marker)
+
+    def test_tree(self):
+        pair = deco.n_ary_tree(lambda x, y: (x, y))
+        self.assertEqual(pair('a', 'b', 'c', 'd'), (('a', 'b'), ('c', 'd')))
+        self.assertEqual(pair('a', 'b', 'c', 'd', 'e'), ((('a', 'b'), ('c', 'd')), 'e'))
+        self.assertEqual(pair('a', 'b', 'c'), (('a', 'b'), 'c'))
+        concat = deco.n_ary_tree(lambda x, y: x + y)
+        for count in range(1, 10):
+            letters = 'abcdefghi'[:count]
+            self.assertEqual(concat(*letters), letters)
+
+    def test_many_arguments(self):
+        args = [1] * (sys.getrecursionlimit() + 100)
+        for n_ary in (deco.n_ary, deco.n_ary_left, deco.n_ary_tree):
+            self.assertEqual(n_ary(lambda x, y: x + y)(*args), len(args))
+
+
+class ProfileTestCase(unittest.TestCase):
+    def test_buckets(self):
+        stats = deco.CallStats()
+        for elapsed in (0, 1, 3, 4, 1000):
+            stats.add(elapsed)
+        self.assertEqual(stats.calls, 5)
+        self.assertEqual((stats.total, stats.min, stats.max), (1008, 0, 1000))
+        self.assertEqual({i: count for i, count in enumerate(stats.buckets) if count},
+                         {0: 1, 1: 1, 2: 1, 3: 1, 10: 1})
+
+    def test_percentiles(self):
+        stats = deco.CallStats()
+        for _ in range(99):
+            stats.add(100)
+        stats.add(5000)
+        self.assertEqual(stats.percentile(50), 128)
+        self.assertEqual(stats.percentile(99), 128)
+        self.assertEqual(stats.percentile(100), 5000)
+        data = stats.as_dict()
+        self.assertEqual((data['calls'], data['mean_ns'], data['min_ns'], data['max_ns']),
+                         (100, 149, 100, 5000))
+        self.assertEqual(data['histogram'], {128: 99, 8192: 1})
+        stats.reset()
+        self.assertEqual(stats.as_dict()['calls'], 0)
+        self.assertEqual(stats.percentile(50), 0)
+
+    def test_profile(self):
+        profiler = deco.Profiler()
+
+        @deco.profile(profiler=profiler)
+        def work(x):
+            if x < 0:
+                raise ValueError(x)
+            return x
+
+        @deco.profile('idle', profiler)
+        async def idle():
+            await asyncio.sleep(0)
+
+        name = '{}.{}'.format(__name__, work.__qualname__)
+        self.assertEqual(set(profiler.stats), {name, 'idle'})
+        self.assertEqual([work(1), work(2)], [1, 2])
+        self.assertRaises(ValueError, work, -1)
+        asyncio.run(idle())
+        self.assertIs(profiler.stats[name], work.stats)
+        self.assertEqual((work.stats.calls, idle.stats.calls), (3, 1))
+
+        profiler.disable()
+        self.assertEqual(work(3), 3)
+        asyncio.run(idle())
+        self.assertEqual((work.stats.calls, idle.stats.calls), (3, 1))
+        profiler.enable()
+        work(4)
+        self.assertEqual(work.stats.calls, 4)
+
+        lines = profiler.summary().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0].split(),
+                         ['function', 'calls', 'total', 'mean', 'min', 'p50', 'p99', 'max'])
+        rows = {line.split()[0]: line.split()[1] for line in lines[1:]}
+        self.assertEqual(rows, {name: '4', 'idle': '1'})
+        data = json.loads(profiler.to_json())
+        self.assertEqual({key: value['calls'] for key, value in data.items()},
+                         {name: 4, 'idle': 1})
+        self.assertEqual(sum(data[name]['histogram'].values()), 4)
+
+        profiler.reset()
+        self.assertEqual(work.stats.calls, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()